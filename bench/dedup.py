@@ -0,0 +1,59 @@
+"""去重结构的内存占用：每 10k 个群各处理过 N 条消息。
+
+对比旧的 deque + set（每群最多 1000 个 ID）与 DedupCache 位图窗口。
+为了跑得快，实际只模拟 SAMPLE_CHATS 个群，再按比例换算到 10k 个群。
+用法：python -m bench.dedup
+"""
+import tracemalloc
+from collections import deque
+from typing import Callable, Deque, Dict, Set
+
+from dedup import DedupCache
+
+CHATS = 10_000
+SAMPLE_CHATS = 1_000
+MAX_PROCESSED_PER_CHAT = 1000
+
+
+def legacy_factory() -> Callable[[int, int], bool]:
+    order: Dict[int, Deque[int]] = {}
+    seen: Dict[int, Set[int]] = {}
+
+    def remember(chat_id: int, msg_id: int) -> bool:
+        chat_order = order.setdefault(chat_id, deque())
+        chat_seen = seen.setdefault(chat_id, set())
+        if msg_id in chat_seen:
+            return False
+        chat_order.append(msg_id)
+        chat_seen.add(msg_id)
+        while len(chat_order) > MAX_PROCESSED_PER_CHAT:
+            chat_seen.discard(chat_order.popleft())
+        return True
+
+    return remember
+
+
+def measure(build: Callable[[], object], remember_of: Callable[[object], Callable[[int, int], bool]], per_chat: int) -> float:
+    tracemalloc.start()
+    holder = build()
+    remember = remember_of(holder)
+    for chat in range(SAMPLE_CHATS):
+        chat_id = -1001000000000 - chat
+        base = 10_000 + chat * 7
+        for msg_id in range(base, base + per_chat):
+            remember(chat_id, msg_id)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current * (CHATS / SAMPLE_CHATS) / (1024 * 1024)
+
+
+def main() -> None:
+    print(f"{'msgs/chat':>10} {'deque+set (MiB/10k chats)':>27} {'DedupCache (MiB/10k chats)':>28}")
+    for per_chat in (5, 100, 1_000):
+        legacy = measure(legacy_factory, lambda fn: fn, per_chat)
+        compact = measure(lambda: DedupCache(window=1024, max_chats=CHATS), lambda cache: cache.remember, per_chat)
+        print(f"{per_chat:>10} {legacy:>27.1f} {compact:>28.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""关键词匹配基准：逐个调用 keyword_hit 与一次构建的 KeywordEngine 对比。
+
+语料是模拟的中英文 VPS/服务器出售群聊天，关键词集中混有通配关键词。
+另外检查 re: 正则的防护：危险写法必须在添加时被拒绝，放行的写法在最坏输入上也要很快。
+用法：python -m bench.keywords
+"""
+import random
+import time
+from typing import List
+
+from keywords import KeywordEngine, KeywordError, compile_query, keyword_hit
+
+PRODUCTS = ["香港 CN2 GIA VPS", "日本 BGP 独服", "美西 9929 小鸡", "HK NAT 机", "新加坡 CMI 线路", "Dedicated Server E5-2680v4"]
+OFFERS = ["三折", "五折优惠", "年付 $19.99", "月付 ¥15", "限时特价", "Black Friday 50% OFF", "买一送一", "续费同价"]
+TAILS = ["私聊 @seller_bot", "库存有限，先到先得", "支持支付宝/USDT", "test ip: 103.1.2.3", "求购 1c1g 小鸡", "出售闲置，可过户"]
+BASE_KEYWORDS = ["出售", "三折", "年付", "求购", "cn2", "gia", "独服", "nat", "usdt", "特价", "过户", "9929", "cmi", "bgp",
+                 "优惠", "小鸡", "库存", "支付宝", "black friday", "off"]
+WILDCARDS = ["出售*独服", "三折*年付", "香港*vps", "$*/yr", "买*送*"]
+
+
+def make_corpus(count: int, seed: int = 0) -> List[str]:
+    rnd = random.Random(seed)
+    return [
+        f"{rnd.choice(PRODUCTS)} {rnd.choice(OFFERS)}，{rnd.choice(TAILS)}\n{rnd.choice(OFFERS)} {rnd.choice(TAILS)}".lower()
+        for _ in range(count)
+    ]
+
+
+def make_keywords(count: int, seed: int = 0) -> List[str]:
+    rnd = random.Random(seed)
+    keywords = list(BASE_KEYWORDS) + list(WILDCARDS)
+    while len(keywords) < count:
+        keywords.append(f"{rnd.choice(BASE_KEYWORDS)}{rnd.randrange(10_000)}")
+        if rnd.random() < 0.1:
+            keywords.append(f"{rnd.choice(BASE_KEYWORDS)}*{rnd.randrange(1_000)}")
+    return keywords[:count]
+
+
+# 会灾难性回溯的正则，添加时必须被拒绝
+REJECTED_REGEXES = [
+    "re:.*.*x",
+    "re:a+a+b",
+    r"re:\w+\s*\w+$",
+    "re:.{0,100}.{0,100}x",
+    "re:(a+)+b",
+    "re:(ab|a)*c",
+    r"re:(a)\1",
+    "re:(?:a?){10}(?:a?){10}b",
+    "re:(?:a?){10}b",
+    "re:a{0,10}a{0,10}a{0,10}a{0,10}a{0,10}b",
+    "re:a?a?a?a?a?a?a?a?a?a?b",
+]
+# 允许的写法：在全是 a 的长消息上匹配失败（最坏情况）
+# (\w|a)*b 会被 re 合并成字符集 [\wa]*b，不会指数回溯，只受文本长度影响
+ACCEPTED_REGEXES = ["re:.*x", "re:[a-z]+x", r"re:(\w|a)*b", r"re:\d+G内存", r"re:(?:\d{3}\.){3}\d+"]
+
+
+def check_regex_guard() -> None:
+    for keyword in REJECTED_REGEXES:
+        try:
+            compile_query((keyword,))
+        except KeywordError:
+            continue
+        raise AssertionError(f"{keyword} 应该被拒绝")
+    text = "a" * 100_000
+    print(f"{'regex':>24} {'worst case (ms)':>16}")
+    for keyword in ACCEPTED_REGEXES:
+        query = compile_query((keyword,))
+        start = time.perf_counter()
+        query.matches(text, set())
+        elapsed = time.perf_counter() - start
+        print(f"{keyword:>24} {elapsed * 1e3:>16.1f}")
+        assert elapsed < 0.01, f"{keyword} 最坏情况耗时 {elapsed:.3f}s"
+
+
+def main() -> None:
+    check_regex_guard()
+    corpus = make_corpus(2_000)
+    print(f"{'keywords':>9} {'keyword_hit (us/msg)':>21} {'engine (us/msg)':>16} {'speedup':>8}")
+    for count in (10, 100, 1_000, 5_000):
+        keywords = make_keywords(count)
+        engine = KeywordEngine(keywords)
+        for text in corpus[:200]:
+            assert engine.hits(text) == {kw.lower() for kw in keywords if keyword_hit(text, kw)}
+
+        start = time.perf_counter()
+        for text in corpus:
+            [kw for kw in keywords if keyword_hit(text, kw)]
+        legacy = (time.perf_counter() - start) / len(corpus)
+
+        start = time.perf_counter()
+        for text in corpus:
+            engine.hits(text)
+        fast = (time.perf_counter() - start) / len(corpus)
+        print(f"{count:>9} {legacy * 1e6:>21.1f} {fast * 1e6:>16.1f} {legacy / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""用模拟延迟的假客户端测轮询 tick 的耗时与增量追赶。
+
+部分群会超时或抛错，用来确认它们不会拖慢其他群；两轮之间每个群会
+突发若干条新消息（可能远超 5 条），第二轮应当恰好处理这些新消息；
+最后检查超过翻页上限的突发会分几次追完、一条不漏。
+用法：python -m bench.poller
+"""
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import Dict
+
+from poller import Poller
+
+CHATS = 200
+LATENCY = (0.05, 0.3)
+SLOW_CHATS = {-1001000000003, -1001000000077}
+BROKEN_CHATS = {-1001000000010}
+
+
+class FakeClient:
+    def __init__(self, chat_ids, seed: int = 0) -> None:
+        self._rnd = random.Random(seed)
+        self.latest: Dict[int, int] = {chat_id: self._rnd.randrange(100, 10_000) for chat_id in chat_ids}
+        self.calls = 0
+
+    def burst(self) -> int:
+        total = 0
+        for chat_id in self.latest:
+            count = self._rnd.choice((0, 0, 1, 3, 20, 250))
+            self.latest[chat_id] += count
+            if chat_id not in SLOW_CHATS | BROKEN_CHATS:
+                total += count
+        return total
+
+    async def get_chat_history(self, chat_id: int, limit: int = 0, offset: int = 0, offset_id: int = 0):
+        self.calls += 1
+        if chat_id in BROKEN_CHATS:
+            raise RuntimeError("CHANNEL_PRIVATE")
+        await asyncio.sleep(60 if chat_id in SLOW_CHATS else self._rnd.uniform(*LATENCY))
+        # 与 Telegram 一致：从 offset_id 之前的一条开始，再偏移 offset 条（负数往新的方向）
+        top = min(self.latest[chat_id], offset_id - 1 - offset) if offset_id else self.latest[chat_id]
+        for msg_id in range(top, max(0, top - limit), -1):
+            yield SimpleNamespace(id=msg_id, chat=SimpleNamespace(id=chat_id))
+
+
+async def run(concurrency: int) -> None:
+    handled = 0
+
+    async def handler(msg) -> None:
+        nonlocal handled
+        handled += 1
+
+    chat_ids = [-1001000000000 - i for i in range(CHATS)]
+    client = FakeClient(chat_ids)
+    poller = Poller(handler, concurrency=concurrency, timeout=2.0)
+    for label in ("initial", "burst"):
+        expected = client.burst() if label == "burst" else None
+        handled, client.calls = 0, 0
+        report = await poller.tick(client, chat_ids)
+        slowest = max(report.per_chat.values())
+        print(
+            f"concurrency={concurrency:>3} {label:>7} tick={report.duration:6.2f}s slowest={slowest:5.2f}s "
+            f"calls={client.calls:>4} messages={handled:>5} expected={expected if expected is not None else '-':>5} "
+            f"failed={len(report.failed)} timed_out={len(report.timed_out)}"
+        )
+
+
+async def check_truncated() -> None:
+    """一个群一次来了超过 max_pages 页的消息：分几次 tick 追完，每条恰好处理一次。"""
+    chat_id = -1001000000001
+    client = FakeClient([chat_id])
+    seen = []
+
+    async def handler(msg) -> None:
+        seen.append(msg.id)
+
+    poller = Poller(handler, timeout=60.0, cursors={chat_id: client.latest[chat_id]})
+    first = client.latest[chat_id] + 1
+    client.latest[chat_id] += 2_500
+    ticks = 0
+    while True:
+        ticks += 1
+        report = await poller.tick(client, [chat_id])
+        if not report.truncated:
+            break
+    assert seen == list(range(first, client.latest[chat_id] + 1)), "超过页数上限时有消息被跳过或重复"
+    print(f"truncated burst: {len(seen)} messages in {ticks} ticks, none skipped")
+
+
+def main() -> None:
+    for concurrency in (8, 32):
+        asyncio.run(run(concurrency))
+    asyncio.run(check_truncated())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""离线回放：把录制或合成的消息流送进真实的 process_message 与通知发送流程。
+
+bot / user 客户端都换成本地桩：StubBot 记录每次发送，可注入发送延迟和
+FloodWait；StubUser 按 get_chat_history 接口回放同一批消息，用于走轮询路径，
+同样可注入拉取延迟和 FloodWait（--history-latency / --history-flood-every）。
+不需要网络和 Telegram 账号，可用来在修改规则或关键词逻辑后对比性能。
+
+输入的 JSONL 每行一条消息：{"chat_id": -100..., "sender_id": 123, "text": "...", "id": 1}
+不提供 --input 时按 --messages 生成合成消息。
+
+用法：
+  python -m bench.replay
+  python -m bench.replay --rules 10,1000,50000 --messages 20000 --rate 2000
+  python -m bench.replay --input messages.jsonl --via poll --send-latency 0.02 --flood-every 500
+  python -m bench.replay --rules 50000 --match-workers 4
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import re
+import resource
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+from pyrogram.errors import FloodWait
+
+import main as app
+from dedup import DedupCache
+from delivery import Notifier
+from matcher import RulesSnapshot
+from matchpool import MatchPool
+from profiler import RuleProfiler
+from poller import Poller
+
+KEYWORDS = ["出售", "三折", "年付", "求购", "vps", "cn2", "gia", "独服", "hk", "jp"]
+VOCABULARY = KEYWORDS + [f"词{i}" for i in range(2000)]
+FILLER = ["今天", "有没有", "便宜", "的", "机器", "谁", "要", "价格", "私聊", "看看", "ok", "thanks"]
+GROUPS = 200
+SENDERS = 5000
+LINK = re.compile(r"/(\d+)$")
+
+
+def make_data(rule_count: int, seed: int = 0) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+    owners = max(1, rule_count // 20)
+    users: Dict[str, Any] = {}
+    for i in range(rule_count):
+        bucket = users.setdefault(str(1000 + i % owners), {"notify_targets": [], "rules": []})
+        bucket["rules"].append({
+            "group_id": -1001000000000 - rnd.randrange(GROUPS) if rnd.random() < 0.9 else None,
+            "user_id": rnd.randrange(1, SENDERS) if rnd.random() < 0.3 else None,
+            "keywords": rnd.sample(VOCABULARY if rnd.random() < 0.7 else KEYWORDS, rnd.randint(1, 3)),
+        })
+    return {"users": users}
+
+
+def synthetic(count: int, seed: int = 1) -> Iterator[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    next_id: Dict[int, int] = {}
+    for _ in range(count):
+        # 四分之一的消息来自没有规则的群，应在 may_match 处被丢弃
+        chat_id = -1001000000000 - rnd.randrange(GROUPS * 4 // 3)
+        msg_id = next_id[chat_id] = next_id.get(chat_id, 0) + 1
+        words = rnd.choices(FILLER, k=rnd.randint(3, 20))
+        if rnd.random() < 0.2:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(VOCABULARY if rnd.random() < 0.3 else KEYWORDS))
+        yield {"chat_id": chat_id, "sender_id": rnd.randrange(1, SENDERS), "text": " ".join(words), "id": msg_id}
+
+
+def load_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def to_message(record: Dict[str, Any]) -> SimpleNamespace:
+    chat_id = int(record["chat_id"])
+    return SimpleNamespace(
+        id=int(record["id"]),
+        text=record.get("text"),
+        caption=record.get("caption"),
+        date=datetime.now(),
+        chat=SimpleNamespace(id=chat_id, title=record.get("chat_title"), username=None),
+        from_user=SimpleNamespace(
+            id=int(record["sender_id"]), first_name=record.get("sender_name", "user"), last_name=None, username=None
+        ),
+    )
+
+
+class StubBot:
+    """记录发送；每次发送等待 latency 秒，每 flood_every 次发送抛一次 FloodWait。"""
+
+    def __init__(self, latency: float = 0.0, flood_every: int = 0, flood_seconds: int = 1) -> None:
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.calls = 0
+        self.floods = 0
+        self.sent: List[tuple] = []
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        self.calls += 1
+        if self.flood_every and self.calls % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+
+class StubUser:
+    """按 Pyrogram get_chat_history 的语义回放已"到达"的消息（新到旧）。
+
+    每次请求（一页）等待 latency 秒，每 flood_every 次请求抛一次 FloodWait。
+    """
+
+    def __init__(self, latency: float = 0.0, flood_every: int = 0, flood_seconds: int = 1) -> None:
+        self.history: Dict[int, List[Any]] = {}
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.calls = 0
+        self.floods = 0
+
+    def deliver(self, message: Any) -> None:
+        self.history.setdefault(message.chat.id, []).append(message)
+
+    async def get_chat_history(self, chat_id: int, limit: int = 0, offset: int = 0, offset_id: int = 0):
+        self.calls += 1
+        if self.flood_every and self.calls % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # 与 Telegram 一致：从第一条 id < offset_id 的消息处开始，再偏移 offset 条（负数往新的方向）
+        history = self.history.get(chat_id, [])[::-1]
+        start = next((i for i, message in enumerate(history) if message.id < offset_id), len(history)) if offset_id else 0
+        start = max(0, start + offset)
+        for message in history[start:start + limit]:
+            yield message
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def replay(records: List[Dict[str, Any]], rule_count: int, args: argparse.Namespace) -> None:
+    data = make_data(rule_count)
+    gc.collect()
+    tracemalloc.start()
+    snapshot = RulesSnapshot.build(data)
+    snapshot.engine  # 关键词自动机是惰性构建的，计入规则内存
+    rules_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+
+    bot = StubBot(args.send_latency, args.flood_every)
+    app.DATA_CACHE = data
+    app.RULES = snapshot
+    app.DEDUP = DedupCache(window=1024, max_chats=20000)
+    app.NOTIFIER = Notifier(
+        bot.send_message,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        target_rate=args.target_rate,
+        target_burst=args.target_rate,
+        global_rate=args.global_rate,
+    )
+    app.NOTIFIER.start()
+    app.MATCHER = MatchPool(
+        app.NORMALIZER,
+        workers=args.match_workers,
+        min_rules=args.match_min_rules,
+        batch_size=args.match_batch,
+        profiler=RuleProfiler(enabled=args.profile),
+    )
+    app.MATCHER.start()
+    if args.match_workers:
+        # 子进程启动和第一次接收规则不计入回放时间
+        await asyncio.gather(*(app.MATCHER.match(snapshot, 0, 0, "预热") for _ in range(args.match_batch * args.match_workers)))
+
+    injected: Dict[tuple, float] = {}
+    handle_times: List[float] = []
+    user = StubUser(args.history_latency, args.history_flood_every)
+    poller = Poller(app.on_polled_message, concurrency=8, page_size=100, max_pages=1000)
+
+    async def timed(message: Any) -> None:
+        t0 = time.perf_counter()
+        await app.process_message(message)
+        handle_times.append(time.perf_counter() - t0)
+
+    # 用进程池匹配时同时提交一批消息，才能攒成小批次
+    inflight: List[Any] = []
+    started = time.monotonic()
+    for i, record in enumerate(records):
+        if args.rate:
+            delay = started + i / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        message = to_message(record)
+        injected[(message.chat.id, message.id)] = time.monotonic()
+        if args.via == "poll":
+            user.deliver(message)
+            continue
+        if args.match_workers:
+            inflight.append(timed(message))
+            if len(inflight) >= args.match_batch:
+                await asyncio.gather(*inflight)
+                inflight.clear()
+            continue
+        await timed(message)
+        if i % 256 == 0:
+            await asyncio.sleep(0)  # 让发送协程有机会运行，模拟真实的事件循环交错
+    await asyncio.gather(*inflight)
+
+    if args.via == "poll":
+        # 先把游标放到 0，第一轮轮询就能追上全部消息
+        poller.cursors = {chat_id: 0 for chat_id in user.history}
+        t0 = time.perf_counter()
+        pending = list(user.history)
+        # FloodWait 的群本轮算失败，下一轮从游标处接着拉，直到全部追上（--history-flood-every 1 时永远追不上）
+        for _ in range(100):
+            if not pending:
+                break
+            report = await poller.tick(user, pending)
+            pending = report.failed + report.timed_out
+        handle_times.append(time.perf_counter() - t0)
+    handled = time.monotonic() - started
+
+    await app.MATCHER.close()
+    await app.NOTIFIER.stop(drain_timeout=args.drain_timeout)
+    finished = time.monotonic() - started
+
+    deliveries: List[float] = []
+    for sent_at, _target, text in bot.sent:
+        link = text.rsplit("📍 直达：", 1)[-1]
+        found = LINK.search(link)
+        if not found:
+            continue
+        chat = -int("100" + link.split("/c/", 1)[-1].split("/", 1)[0]) if "/c/" in link else None
+        origin = injected.get((chat, int(found.group(1))))
+        if origin is not None:
+            deliveries.append(sent_at - origin)
+
+    maxrss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    label = "总轮询" if args.via == "poll" else "单条处理"
+    print(
+        f"rules={rule_count:>6} messages={len(records):>6} "
+        f"吞吐={len(records) / handled:>9.0f} 条/s  "
+        f"{label} p50={percentile(handle_times, 0.5) * 1e6:>7.1f}µs p99={percentile(handle_times, 0.99) * 1e6:>8.1f}µs  "
+        f"通知={len(bot.sent):>6} FloodWait={bot.floods:>3}/{user.floods:<3} 丢弃={app.NOTIFIER.dropped:>4} "
+        f"送达 p50={percentile(deliveries, 0.5) * 1e3:>7.1f}ms p99={percentile(deliveries, 0.99) * 1e3:>8.1f}ms  "
+        f"总耗时={finished:6.2f}s 规则内存={rules_mb:6.1f}MB maxrss={maxrss_mb:6.0f}MB"
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="离线回放消息流，测量匹配与通知发送的性能")
+    parser.add_argument("--input", help="JSONL 消息文件；不提供时生成合成消息")
+    parser.add_argument("--rules", default="10,1000,50000", help="逗号分隔的规则数量")
+    parser.add_argument("--messages", type=int, default=5000, help="合成消息数量")
+    parser.add_argument("--rate", type=float, default=0, help="每秒注入的消息数，0 表示尽快")
+    parser.add_argument("--via", choices=("live", "poll"), default="live", help="实时推送路径或轮询路径")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="每次发送的模拟延迟（秒）")
+    parser.add_argument("--flood-every", type=int, default=0, help="每 N 次发送注入一次 FloodWait")
+    parser.add_argument("--history-latency", type=float, default=0.0, help="轮询时每次拉取历史的模拟延迟（秒）")
+    parser.add_argument("--history-flood-every", type=int, default=0, help="轮询时每 N 次拉取历史注入一次 FloodWait")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=100000)
+    parser.add_argument("--target-rate", type=float, default=1000.0, help="每个目标每秒条数（默认不限速）")
+    parser.add_argument("--global-rate", type=float, default=100000.0, help="全局每秒条数（默认不限速）")
+    parser.add_argument("--match-workers", type=int, default=0, help="匹配进程池大小，0 表示在事件循环里匹配")
+    parser.add_argument("--match-min-rules", type=int, default=0, help="规则数达到多少才交给进程池")
+    parser.add_argument("--match-batch", type=int, default=64, help="进程池小批次大小")
+    parser.add_argument("--profile", action="store_true", help="开启规则开销统计，用于衡量 /profile on 的额外开销")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # 每条通知都有一行 INFO 日志，回放时只保留错误
+    logging.basicConfig(level=logging.ERROR)
+    records = list(load_jsonl(args.input) if args.input else synthetic(args.messages))
+    for rule_count in (int(x) for x in args.rules.split(",") if x.strip()):
+        asyncio.run(replay(records, rule_count, args))
+
+
+if __name__ == "__main__":
+    main()
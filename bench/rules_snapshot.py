@@ -0,0 +1,65 @@
+"""单条消息的规则匹配耗时随规则数量的变化。
+
+对比旧做法（每条消息 json 往返复制整个规则库再全量扫描）与不可变快照 + 索引。
+用法：python -m bench.rules_snapshot
+"""
+import json
+import random
+import timeit
+from typing import Any, Dict, List
+
+from keywords import keyword_hit
+from matcher import RulesSnapshot
+
+KEYWORDS = ["出售", "三折", "年付", "求购", "vps", "cn2", "gia", "独服", "hk", "jp"]
+RULE_COUNTS = [10, 100, 1_000, 10_000]
+OWNERS = 50
+GROUPS = 200
+
+
+def make_data(rule_count: int, seed: int = 0) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+    users: Dict[str, Any] = {}
+    for i in range(rule_count):
+        bucket = users.setdefault(str(1000 + i % OWNERS), {"notify_targets": [], "rules": []})
+        bucket["rules"].append({
+            "group_id": -1001000000000 - rnd.randrange(GROUPS) if rnd.random() < 0.9 else None,
+            "user_id": rnd.randrange(1, 5000) if rnd.random() < 0.5 else None,
+            "keywords": rnd.sample(KEYWORDS, rnd.randint(1, 3)),
+        })
+    return {"users": users}
+
+
+def legacy_match(data: Dict[str, Any], group_id: int, sender_id: int, content_lower: str) -> Dict[str, Any]:
+    data_snapshot = json.loads(json.dumps(data))
+    matched: Dict[str, Any] = {}
+    for owner_id, bucket in data_snapshot.get("users", {}).items():
+        for rule in bucket.get("rules", []):
+            if rule.get("group_id") is not None and rule["group_id"] != group_id:
+                continue
+            if rule.get("user_id") is not None and rule["user_id"] != sender_id:
+                continue
+            hit = [kw for kw in rule["keywords"] if keyword_hit(content_lower, kw)]
+            if hit:
+                matched.setdefault(owner_id, set()).update(hit)
+    return matched
+
+
+def main() -> None:
+    content_lower = "出售 hk cn2 gia vps 三折 年付 优惠，私聊".lower()
+    group_id, sender_id = -1001000000007, 42
+    rows: List[str] = []
+    for count in RULE_COUNTS:
+        data = make_data(count)
+        snapshot = RulesSnapshot.build(data)
+        assert snapshot.match(group_id, sender_id, content_lower) == legacy_match(data, group_id, sender_id, content_lower)
+        number = max(10, 20_000 // count)
+        legacy = min(timeit.repeat(lambda: legacy_match(data, group_id, sender_id, content_lower), number=number, repeat=3)) / number
+        fast = min(timeit.repeat(lambda: snapshot.match(group_id, sender_id, content_lower), number=number * 10, repeat=3)) / (number * 10)
+        rows.append(f"{count:>8} {legacy * 1e6:>14.1f} {fast * 1e6:>14.2f} {legacy / fast:>8.0f}x")
+    print(f"{'rules':>8} {'legacy (us)':>14} {'snapshot (us)':>14} {'speedup':>9}")
+    print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple, TypeVar
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # 可选依赖，只有 BUS_URL 指向 Redis 时才需要
+    aioredis = None
+
+T = TypeVar("T")
+
+
+class MessageEvent(NamedTuple):
+    """采集端发布、匹配端消费的消息事件，只保留匹配和渲染通知需要的字段。"""
+
+    chat_id: int
+    msg_id: int
+    sender_id: int
+    text: str
+    date: float
+    source: str
+    chat_title: Optional[str] = None
+    chat_username: Optional[str] = None
+    sender_name: str = ""
+
+    @classmethod
+    def from_message(cls, message: Any, text: str, source: str) -> "MessageEvent":
+        user = message.from_user
+        name = user.first_name or ""
+        if user.last_name:
+            name = f"{name} {user.last_name}".strip()
+        if user.username:
+            name = f"{name} (@{user.username})".strip()
+        return cls(
+            chat_id=message.chat.id,
+            msg_id=message.id,
+            sender_id=user.id,
+            text=text,
+            date=message.date.timestamp() if message.date else 0.0,
+            source=source,
+            chat_title=message.chat.title,
+            chat_username=message.chat.username,
+            sender_name=name or str(user.id),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "MessageEvent":
+        return cls(**json.loads(raw))
+
+
+Claimed = List[Tuple[str, MessageEvent]]
+
+BUS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    msg_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    done INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (chat_id, msg_id)
+);
+CREATE INDEX IF NOT EXISTS events_pending ON events (done, id);
+"""
+
+
+class SQLiteBus:
+    """基于 SQLite 的本地消息队列，多个采集/匹配进程共用同一个文件。
+
+    (chat_id, msg_id) 唯一：多个会话或实时/轮询重复发布同一条消息只会入队一次，
+    起到全局去重的作用。消费者认领一批事件，处理完再确认；认领后超过
+    visibility 秒仍未确认（比如进程重启）的事件会被重新认领，不会丢。
+    已确认的事件保留 retention 秒用于去重，之后清理。
+    """
+
+    def __init__(self, path: Path, visibility: float = 60.0, retention: float = 86400.0) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.visibility = visibility
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bus")
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(BUS_SCHEMA)
+        self._last_prune = 0.0
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def start(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+    def _publish(self, event: MessageEvent) -> bool:
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO events (chat_id, msg_id, payload, created) VALUES (?, ?, ?, ?)",
+            (event.chat_id, event.msg_id, event.to_json(), time.time()),
+        )
+        return cur.rowcount > 0
+
+    async def publish(self, event: MessageEvent) -> bool:
+        """发布事件；同一条消息已经发布过时返回 False。"""
+        return await self._run(self._publish, event)
+
+    def _claim(self, consumer: str, limit: int) -> Claimed:
+        conn = self._conn
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM events WHERE done = 0 AND (claimed_at IS NULL OR claimed_at < ?) "
+                "ORDER BY id LIMIT ?",
+                (now - self.visibility, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE events SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(consumer, now, row_id) for row_id, _ in rows],
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return [(str(row_id), MessageEvent.from_json(payload)) for row_id, payload in rows]
+
+    async def claim(self, consumer: str, limit: int = 100, block: float = 1.0) -> Claimed:
+        """认领最多 limit 个待处理事件；没有事件时最多等待 block 秒。"""
+        deadline = time.monotonic() + block
+        while True:
+            claimed = await self._run(self._claim, consumer, limit)
+            if claimed or time.monotonic() >= deadline:
+                return claimed
+            await asyncio.sleep(min(0.2, max(0.0, deadline - time.monotonic())))
+
+    def _ack(self, ids: List[str]) -> None:
+        self._conn.executemany("UPDATE events SET done = 1 WHERE id = ?", [(int(i),) for i in ids])
+        now = time.time()
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            self._conn.execute("DELETE FROM events WHERE done = 1 AND created < ?", (now - self.retention,))
+
+    async def ack(self, ids: List[str]) -> None:
+        if ids:
+            await self._run(self._ack, ids)
+
+    def _pending(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM events WHERE done = 0").fetchone()[0]
+
+    async def pending(self) -> int:
+        return await self._run(self._pending)
+
+
+class RedisBus:
+    """基于 Redis Stream 的消息队列（需要安装 redis）。
+
+    发布前用 SET NX 记录 (chat_id, msg_id) 做全局去重；消费者组保证每个事件
+    只交给一个匹配进程，超过 visibility 秒未确认的事件由其他消费者接手。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        stream: str = "tgmon:events",
+        group: str = "matchers",
+        visibility: float = 60.0,
+        retention: float = 86400.0,
+        max_length: int = 100000,
+    ) -> None:
+        if aioredis is None:
+            raise RuntimeError("使用 Redis 消息队列需要先安装 redis：pip install redis")
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.stream = stream
+        self.group = group
+        self.visibility = visibility
+        self.retention = retention
+        self.max_length = max_length
+
+    async def start(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except aioredis.ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+    async def publish(self, event: MessageEvent) -> bool:
+        seen_key = f"{self.stream}:seen:{event.chat_id}:{event.msg_id}"
+        if not await self.redis.set(seen_key, 1, nx=True, ex=int(self.retention)):
+            return False
+        await self.redis.xadd(self.stream, {"event": event.to_json()}, maxlen=self.max_length, approximate=True)
+        return True
+
+    async def claim(self, consumer: str, limit: int = 100, block: float = 1.0) -> Claimed:
+        # 先接手其他消费者认领后超时未确认的事件，再读新事件
+        reclaimed = await self.redis.xautoclaim(
+            self.stream, self.group, consumer, min_idle_time=int(self.visibility * 1000), start_id="0-0", count=limit
+        )
+        entries = list(reclaimed[1]) if reclaimed and len(reclaimed) > 1 else []
+        if not entries:
+            response = await self.redis.xreadgroup(
+                self.group, consumer, {self.stream: ">"}, count=limit, block=int(block * 1000)
+            )
+            for _stream, stream_entries in response or []:
+                entries.extend(stream_entries)
+        return [(entry_id, MessageEvent.from_json(fields["event"])) for entry_id, fields in entries if fields]
+
+    async def ack(self, ids: List[str]) -> None:
+        if ids:
+            await self.redis.xack(self.stream, self.group, *ids)
+
+    async def pending(self) -> int:
+        info = await self.redis.xpending(self.stream, self.group)
+        return int(info.get("pending", 0)) if isinstance(info, dict) else 0
+
+
+def open_bus(url: str, visibility: float = 60.0, retention: float = 86400.0):
+    """BUS_URL 为 redis://... 时用 Redis Stream，否则视为 SQLite 文件路径。"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(url, visibility=visibility, retention=retention)
+    return SQLiteBus(Path(url), visibility=visibility, retention=retention)
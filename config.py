@@ -6,15 +6,112 @@ API_ID = int(os.getenv("TG_API_ID", "0"))
 API_HASH = os.getenv("TG_API_HASH", "")
 BOT_TOKEN = os.getenv("TG_BOT_TOKEN", "")
 USER_SESSION_STRING = os.getenv("TG_USER_SESSION_STRING", "")
+# 多个 userbot 分担轮询：逗号分隔的 session string，未设置时只用 TG_USER_SESSION_STRING
+USER_SESSION_STRINGS = [
+    x.strip() for x in os.getenv("TG_USER_SESSION_STRINGS", USER_SESSION_STRING).split(",") if x.strip()
+]
 
-# 规则文件路径
+# SQLite 数据库路径（规则、通知目标、管理员、轮询游标、去重状态）
+DB_PATH = Path(os.getenv("DB_PATH", "./data/monitor.db"))
+
+# 旧版 JSON 规则文件路径，首次启动时自动导入数据库
 RULES_PATH = Path(os.getenv("RULES_PATH", "./rules.json"))
 
-# 日志等级
+# 日志等级、格式（text 或 json），以及同一条警告的最短重复间隔（秒，0 不限流）
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "300"))
 
 # 超级管理员（环境变量配置，不可被删除）
 SUPER_ADMIN_IDS = [int(x.strip()) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 
-# 动态管理员文件路径
+# 旧版动态管理员文件路径，首次启动时自动导入数据库
 ADMINS_PATH = Path(os.getenv("ADMINS_PATH", "./admins.json"))
+
+# 轮询：同时拉取的群数量、单个群的超时秒数
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "8"))
+POLL_CHAT_TIMEOUT = float(os.getenv("POLL_CHAT_TIMEOUT", "15"))
+# 单个群每轮最多向前翻的页数（每页 100 条）
+POLL_MAX_PAGES = int(os.getenv("POLL_MAX_PAGES", "10"))
+
+# 消息去重：每个群记住最近多少个消息 ID、最多记多少个群、多久落盘一次（秒）
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "1024"))
+DEDUP_MAX_CHATS = int(os.getenv("DEDUP_MAX_CHATS", "20000"))
+DEDUP_SNAPSHOT_INTERVAL = float(os.getenv("DEDUP_SNAPSHOT_INTERVAL", "60"))
+
+# 自适应轮询间隔（秒）：最短、最长，以及实时推送正常时的兜底间隔
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "3"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+POLL_LIVE_INTERVAL = float(os.getenv("POLL_LIVE_INTERVAL", "120"))
+
+# 旧版轮询游标文件路径，首次启动时自动导入数据库
+CURSORS_PATH = Path(os.getenv("CURSORS_PATH", "./cursors.json"))
+
+# 通知发送：发送协程数、队列长度、每个目标/全局每秒条数、FloodWait 重试次数
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+NOTIFY_TARGET_RATE = float(os.getenv("NOTIFY_TARGET_RATE", "1"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+
+# 匹配前的文本规范化步骤，逗号分隔，留空关闭：
+# width 全角/兼容字符、simplified 繁转简、invisible 去零宽字符、emoji 去表情
+NORMALIZE_TEXT = [x.strip() for x in os.getenv("NORMALIZE_TEXT", "width,simplified,invisible,emoji").split(",") if x.strip()]
+
+# 汇总通知允许设置的最长合并窗口（秒）
+NOTIFY_DIGEST_MAX_WINDOW = int(os.getenv("NOTIFY_DIGEST_MAX_WINDOW", "3600"))
+
+# Prometheus 指标：/metrics 监听地址与端口，端口设为 0 关闭
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# 多会话：连续多少轮全部拉取失败就暂停该会话、暂停多少秒后重新加入
+SESSION_MAX_FAILURES = int(os.getenv("SESSION_MAX_FAILURES", "3"))
+SESSION_RETRY_AFTER = float(os.getenv("SESSION_RETRY_AFTER", "300"))
+
+# 运行模式：all 单进程全部功能；ingest 只运行 userbot 采集并把消息发布到队列；
+# worker 只从队列消费消息做匹配和通知（可以开多个，分担匹配并可单独重启）
+RUN_MODE = os.getenv("RUN_MODE", "all").lower()
+# 消息队列：SQLite 文件路径，或 redis://host:6379/0 使用 Redis Stream
+BUS_URL = os.getenv("BUS_URL", "./data/bus.db")
+# worker 每次认领的消息数、认领后多少秒未确认就交给其他 worker、已处理消息保留多久用于去重（秒）
+BUS_BATCH = int(os.getenv("BUS_BATCH", "100"))
+BUS_VISIBILITY = float(os.getenv("BUS_VISIBILITY", "60"))
+BUS_RETENTION = float(os.getenv("BUS_RETENTION", "86400"))
+# 多个 worker 时只让其中一个处理 bot 命令，其余设为 0
+WORKER_COMMANDS = os.getenv("WORKER_COMMANDS", "1") not in ("0", "false", "no")
+# ingest/worker 模式下检查其他进程是否改了规则的间隔（秒）
+RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "2"))
+
+# 匹配进程池：子进程数（0 关闭，全部在事件循环里匹配）；规则数达到 MATCH_POOL_MIN_RULES
+# 或消息长度达到 MATCH_POOL_MIN_CHARS 时才交给进程池，攒够 MATCH_BATCH_SIZE 条或等待
+# MATCH_BATCH_DELAY 秒后一起提交
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", "0"))
+MATCH_POOL_MIN_RULES = int(os.getenv("MATCH_POOL_MIN_RULES", "5000"))
+MATCH_POOL_MIN_CHARS = int(os.getenv("MATCH_POOL_MIN_CHARS", "2000"))
+MATCH_BATCH_SIZE = int(os.getenv("MATCH_BATCH_SIZE", "64"))
+MATCH_BATCH_DELAY = float(os.getenv("MATCH_BATCH_DELAY", "0.002"))
+
+# 批量添加：一条消息或一个导入文件最多多少条规则、导入文件最大字节数
+BULK_MAX_RULES = int(os.getenv("BULK_MAX_RULES", "10000"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(1024 * 1024)))
+
+# 群缓存：用户名解析结果和群名的有效期（秒）、后台刷新间隔（秒）及每次最多刷新的群数
+PEER_CACHE_TTL = float(os.getenv("PEER_CACHE_TTL", "86400"))
+PEER_REFRESH_INTERVAL = float(os.getenv("PEER_REFRESH_INTERVAL", "300"))
+PEER_REFRESH_BATCH = int(os.getenv("PEER_REFRESH_BATCH", "20"))
+
+# 启动补拉：重启后先把各群停机期间的消息补拉一遍再进入正常轮询；
+# 总时长上限（秒，0 关闭）和单个群最多翻的页数（每页 100 条）
+CATCHUP_BUDGET = float(os.getenv("CATCHUP_BUDGET", "120"))
+CATCHUP_MAX_PAGES = int(os.getenv("CATCHUP_MAX_PAGES", "50"))
+
+# 待发送通知的快照间隔（秒），重启后重新入队；多个 worker 共用数据库时各自设不同的 INSTANCE_NAME
+NOTIFY_SNAPSHOT_INTERVAL = float(os.getenv("NOTIFY_SNAPSHOT_INTERVAL", "5"))
+INSTANCE_NAME = os.getenv("INSTANCE_NAME", "default")
+
+# 启动时就开启规则开销统计（/profile），1 开启；平时保持关闭，需要时用 /profile on
+PROFILE_RULES = os.getenv("PROFILE_RULES", "0") in ("1", "true", "yes")
+
+# 记住多少条消息提取出的可搜索文本（正文、按钮、转发来源、投票等），避免同一条消息重复提取
+EXTRACT_CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "10000"))
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Set, Tuple
+
+
+class _Window:
+    __slots__ = ("hi", "bits")
+
+    def __init__(self, hi: int, bits: int) -> None:
+        self.hi = hi
+        self.bits = bits
+
+
+class DedupCache:
+    """按群记录已处理过的消息 ID，内存占用固定。
+
+    每个群只保存最大的消息 ID（hi）和一个 window 位的位图，第 i 位表示
+    hi - i 是否已处理。比 hi - window 还旧的消息一律视为已处理。
+    群的数量超过 max_chats 时淘汰最久没有消息的群（LRU）。
+
+    snapshot() 返回自上次快照以来有变化的群的序列化状态和被淘汰的群，
+    用于定期持久化，重启后通过 restore() 恢复。
+    """
+
+    def __init__(self, window: int = 1024, max_chats: int = 20000) -> None:
+        self.window = max(8, (window + 7) // 8 * 8)
+        self.max_chats = max(1, max_chats)
+        self._mask = (1 << self.window) - 1
+        self._chats: "OrderedDict[int, _Window]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._evicted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def remember(self, chat_id: int, msg_id: int) -> bool:
+        """记录一条消息；第一次见到返回 True，重复返回 False。"""
+        chats = self._chats
+        state = chats.get(chat_id)
+        if state is None:
+            chats[chat_id] = _Window(msg_id, 1)
+            self._touch_new(chat_id)
+            return True
+
+        chats.move_to_end(chat_id)
+        offset = state.hi - msg_id
+        if offset < 0:
+            shift = -offset
+            state.bits = 1 if shift >= self.window else ((state.bits << shift) | 1) & self._mask
+            state.hi = msg_id
+        elif offset >= self.window or (state.bits >> offset) & 1:
+            return False
+        else:
+            state.bits |= 1 << offset
+        self._dirty.add(chat_id)
+        return True
+
+    def _touch_new(self, chat_id: int) -> None:
+        self._dirty.add(chat_id)
+        self._evicted.discard(chat_id)
+        while len(self._chats) > self.max_chats:
+            oldest, _ = self._chats.popitem(last=False)
+            self._dirty.discard(oldest)
+            self._evicted.add(oldest)
+
+    def _encode(self, state: _Window) -> bytes:
+        return state.hi.to_bytes(8, "big", signed=True) + state.bits.to_bytes(self.window // 8, "big")
+
+    def snapshot(self) -> Tuple[Dict[int, bytes], Set[int]]:
+        changed = {chat_id: self._encode(self._chats[chat_id]) for chat_id in self._dirty if chat_id in self._chats}
+        evicted = set(self._evicted)
+        self._dirty.clear()
+        self._evicted.clear()
+        return changed, evicted
+
+    def mark_dirty(self, chat_ids: Iterable[int]) -> None:
+        """持久化失败时把状态放回，下次快照重试。"""
+        self._dirty.update(chat_id for chat_id in chat_ids if chat_id in self._chats)
+
+    def restore(self, states: Dict[int, bytes]) -> None:
+        for chat_id, raw in states.items():
+            if len(raw) < 8:
+                continue
+            hi = int.from_bytes(raw[:8], "big", signed=True)
+            bits = int.from_bytes(raw[8:], "big") & self._mask
+            self._chats[chat_id] = _Window(hi, bits or 1)
+        while len(self._chats) > self.max_chats:
+            oldest, _ = self._chats.popitem(last=False)
+            self._evicted.add(oldest)
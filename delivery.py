@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from pyrogram.errors import FloodWait, RPCError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶限速；pause() 用于遵守 FloodWait 要求的等待时间。"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notification(NamedTuple):
+    target: int
+    text: str
+    created: float
+    # 原消息的发送时间（Unix 时间戳），用于统计端到端延迟；0 表示未知
+    origin: float = 0.0
+
+
+SendFunc = Callable[[int, str], Awaitable[object]]
+
+# Telegram 单条消息的最大长度
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n──────────\n\n"
+
+
+def split_digest(texts: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """把多条提醒合并成尽量少的消息，每条不超过 limit 个字符。"""
+    chunks: List[str] = []
+    current = ""
+    for text in texts:
+        while len(text) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(text[:limit])
+            text = text[limit:]
+        candidate = f"{current}{DIGEST_SEPARATOR}{text}" if current else text
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = text
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Notifier:
+    """通知发送队列：匹配流程只负责入队，由若干个发送协程异步投递。
+
+    每个目标一个令牌桶，另有一个全局令牌桶对应 Bot 的总发送上限。
+    遇到 FloodWait 时暂停该目标的令牌桶指定秒数后重试，而不是丢弃。
+    队列有上限，满了直接丢弃新通知，保证匹配流程永远不会等待发送。
+
+    提交时带 digest_window（秒）的通知先按目标缓存，窗口结束后合并成
+    一条（超长时按 4096 字符拆分）再入队。
+    """
+
+    def __init__(
+        self,
+        send: SendFunc,
+        workers: int = 4,
+        queue_size: int = 1000,
+        target_rate: float = 1.0,
+        target_burst: float = 3.0,
+        global_rate: float = 25.0,
+        max_retries: int = 3,
+    ) -> None:
+        self.send = send
+        self.workers = max(1, workers)
+        self.queue: "asyncio.Queue[Notification]" = asyncio.Queue(maxsize=queue_size)
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.max_retries = max_retries
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._digests: Dict[int, List[str]] = {}
+        self._digest_origins: Dict[int, float] = {}
+        self._digest_tasks: Dict[int, asyncio.Task] = {}
+        # 发送协程已取出、尚未完成的通知
+        self._inflight: Dict[int, Notification] = {}
+        self.dropped = 0
+
+    def _bucket(self, target: int) -> TokenBucket:
+        bucket = self._buckets.get(target)
+        if bucket is None:
+            bucket = self._buckets[target] = TokenBucket(self.target_rate, self.target_burst)
+        return bucket
+
+    def submit(self, target: int, text: str, digest_window: float = 0, origin: float = 0.0) -> bool:
+        if digest_window > 0:
+            self._digests.setdefault(target, []).append(text)
+            # 汇总按其中最早的一条消息计算端到端延迟
+            earliest = self._digest_origins.get(target)
+            if origin and (not earliest or origin < earliest):
+                self._digest_origins[target] = origin
+            if target not in self._digest_tasks:
+                self._digest_tasks[target] = asyncio.create_task(self._flush_later(target, digest_window))
+            return True
+        try:
+            self.queue.put_nowait(Notification(target, text, time.time(), origin))
+            metrics.NOTIFY_QUEUE_DEPTH.set(self.queue.qsize())
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.NOTIFY_FAILURES.inc("queue_full")
+            logger.error("通知队列已满，丢弃通知", extra={"target": target})
+            return False
+
+    async def _flush_later(self, target: int, window: float) -> None:
+        try:
+            await asyncio.sleep(window)
+        finally:
+            self._digest_tasks.pop(target, None)
+            self._flush_digest(target)
+
+    def _digest_chunks(self, target: int) -> List[str]:
+        texts = self._digests.get(target, [])
+        if len(texts) > 1:
+            texts = [f"📦 汇总 {len(texts)} 条提醒"] + texts
+        return split_digest(texts)
+
+    def _flush_digest(self, target: int) -> None:
+        chunks = self._digest_chunks(target)
+        self._digests.pop(target, None)
+        origin = self._digest_origins.pop(target, 0.0)
+        for chunk in chunks:
+            self.submit(target, chunk, origin=origin)
+
+    def pending(self) -> List[Notification]:
+        """尚未确认发出的通知：正在发送的、队列里的，以及缓存中的汇总（按合并后的形式）。
+
+        用于保存快照，重启后通过 restore() 重新入队；崩溃前刚发出的几条可能会重复发送。
+        """
+        items = list(self._inflight.values())
+        items.extend(self.queue._queue)  # asyncio.Queue 没有公开的遍历接口
+        now = time.time()
+        for target in self._digests:
+            origin = self._digest_origins.get(target, 0.0)
+            items.extend(Notification(target, chunk, now, origin) for chunk in self._digest_chunks(target))
+        return items
+
+    def restore(self, items: List[Notification]) -> int:
+        """把快照里的通知重新入队，返回成功入队的条数。"""
+        return sum(self.submit(item.target, item.text, origin=item.origin) for item in items)
+
+    def start(self) -> None:
+        for _ in range(self.workers - len(self._tasks)):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """提前发出缓存中的汇总，尽量把队列里剩余的通知发完，再停止发送协程。"""
+        for task in list(self._digest_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._digest_tasks.values(), return_exceptions=True)
+        if self._tasks and not self.queue.empty():
+            try:
+                await asyncio.wait_for(self.queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("仍有 %d 条通知未发送", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self.queue.get()
+            metrics.NOTIFY_QUEUE_DEPTH.set(self.queue.qsize())
+            key = id(item)
+            self._inflight[key] = item
+            try:
+                await self._deliver(item)
+            except asyncio.CancelledError:
+                # 停止时正在发送的这条留在 _inflight 里，由快照保存
+                raise
+            except Exception as exc:
+                metrics.NOTIFY_FAILURES.inc("error")
+                logger.error("发送通知异常: %s", exc, extra={"target": item.target})
+            finally:
+                self.queue.task_done()
+            self._inflight.pop(key, None)
+
+    async def _deliver(self, item: Notification) -> Optional[object]:
+        bucket = self._bucket(item.target)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            started = time.monotonic()
+            try:
+                result = await self.send(item.target, item.text)
+                metrics.NOTIFY_SEND_SECONDS.observe(time.monotonic() - started)
+                metrics.NOTIFY_SENT.inc()
+                latency = max(0.0, time.time() - item.origin) if item.origin else None
+                if latency is not None:
+                    metrics.END_TO_END_SECONDS.observe(latency)
+                logger.info("已发送通知", extra={"target": item.target, "latency": latency})
+                return result
+            except FloodWait as exc:
+                wait = float(exc.value or 1)
+                bucket.pause(wait)
+                metrics.NOTIFY_FLOOD_WAITS.inc()
+                if attempt < self.max_retries:
+                    logger.warning("发送触发 FloodWait，%g 秒后重试", wait, extra={"target": item.target})
+                    continue
+                metrics.NOTIFY_FAILURES.inc("flood_wait")
+                logger.error("发送通知失败: 多次 FloodWait，已放弃", extra={"target": item.target})
+            except RPCError as exc:
+                metrics.NOTIFY_FAILURES.inc("rpc")
+                logger.error("发送通知失败: %s", exc, extra={"target": item.target})
+                return None
+        return None
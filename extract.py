@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+def _forward_source(message: Any) -> Optional[str]:
+    chat = getattr(message, "forward_from_chat", None)
+    if chat is not None:
+        name = chat.title or chat.username
+        if name and chat.username and chat.username != name:
+            name = f"{name} (@{chat.username})"
+        return name
+    user = getattr(message, "forward_from", None)
+    if user is not None:
+        name = " ".join(part for part in (user.first_name, user.last_name) if part)
+        if user.username:
+            name = f"{name} (@{user.username})".strip()
+        return name or None
+    return getattr(message, "forward_sender_name", None)
+
+
+def _buttons(message: Any) -> Iterable[Tuple[str, Optional[str]]]:
+    markup = getattr(message, "reply_markup", None)
+    rows = getattr(markup, "inline_keyboard", None) or getattr(markup, "keyboard", None) or []
+    for row in rows:
+        for button in row:
+            # 普通键盘的按钮可能直接是字符串
+            if isinstance(button, str):
+                yield button, None
+            else:
+                yield getattr(button, "text", None) or "", getattr(button, "url", None)
+
+
+def _entity_urls(message: Any) -> Iterable[str]:
+    for entity in (getattr(message, "entities", None) or []) + (getattr(message, "caption_entities", None) or []):
+        # 正文里直接写的网址已经在文本中，只有“文字链接”的目标需要补上
+        url = getattr(entity, "url", None)
+        if url:
+            yield url
+
+
+def build_document(message: Any) -> str:
+    """把消息里所有可搜索的文字拼成一段：正文/说明、转发来源、投票、按钮文字和链接、文字链接的目标。
+
+    正文在最前，其余每项一行，只写字段原文、不加"转发自"之类的说明，
+    免得关键词"按钮""投票"命中所有带按钮或投票的消息；没有任何文字时返回空字符串。
+    """
+    parts: List[str] = []
+    body = message.text or message.caption
+    if body:
+        parts.append(str(body))
+    source = _forward_source(message)
+    if source:
+        parts.append(source)
+    poll = getattr(message, "poll", None)
+    if poll is not None:
+        parts.append(poll.question)
+        parts.extend(option.text for option in poll.options or [] if option.text)
+    for label, url in _buttons(message):
+        button = " ".join(part for part in (label, url) if part)
+        if button:
+            parts.append(button)
+    parts.extend(_entity_urls(message))
+    return "\n".join(parts)
+
+
+class ContentExtractor:
+    """按 (chat_id, msg_id) 记住每条消息的可搜索文本。
+
+    同一条消息可能先后从实时推送和轮询两条路径到达，只提取一次。
+    最多记 maxsize 条，超出时淘汰最久未用的。
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = max(1, maxsize)
+        self._cache: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def document(self, message: Any) -> str:
+        key = (message.chat.id, message.id)
+        cache = self._cache
+        document = cache.get(key)
+        if document is not None:
+            cache.move_to_end(key)
+            return document
+        document = cache[key] = build_document(message)
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return document
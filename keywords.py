@@ -0,0 +1,368 @@
+import re
+import sys
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Pattern, Sequence, Set, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore[no-redef]
+
+# 字面关键词少于该数量时，直接逐个做子串判断比 Python 实现的自动机更快
+AC_MIN_PATTERNS = 12
+
+# 正则关键词的长度上限与单个重复次数上限
+REGEX_MAX_LENGTH = 200
+REGEX_MAX_REPEAT = 1000
+# 正则关键词只在消息的前这么多个字符里查找；即使只有一处 .* 或 [a-z]+，
+# 查找失败时的回溯也与文本长度的平方成正比（300 字符约 2ms）
+REGEX_MAX_TEXT = 300
+
+# w: 整词匹配时算作“词内”的字符：\w 去掉中日韩文字。中文不用空格分词，
+# 否则 w:三折 在“香港三折优惠”里就匹配不到
+_WORD_CHAR = r"[^\W\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+
+
+def keyword_hit(content_lower: str, keyword: str) -> bool:
+    """单个关键词的参考实现，KeywordEngine 的结果必须与之一致。"""
+    if keyword == "*":
+        return True
+    lowered = keyword.lower()
+    if "*" not in lowered:
+        return lowered in content_lower
+    pattern = re.escape(lowered).replace("\\*", ".*")
+    try:
+        return re.search(pattern, content_lower) is not None
+    except re.error:
+        return lowered.replace("*", "") in content_lower
+
+
+class AhoCorasick:
+    """多模式子串匹配：一次扫描找出文本中出现过的所有模式。"""
+
+    __slots__ = ("_goto", "_fail", "_out")
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[str, ...]] = [()]
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(())
+                state = nxt
+            if pattern not in out[state]:
+                out[state] = out[state] + (pattern,)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def search(self, text: str) -> Set[str]:
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        found: Set[str] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class _Wildcard:
+    __slots__ = ("segments", "pattern", "fallback")
+
+    def __init__(self, lowered: str) -> None:
+        self.segments = tuple(seg for seg in lowered.split("*") if seg)
+        self.pattern: Optional[Pattern[str]]
+        try:
+            self.pattern = re.compile(re.escape(lowered).replace("\\*", ".*"))
+        except re.error:
+            self.pattern = None
+        self.fallback = lowered.replace("*", "")
+
+    def hit(self, content_lower: str) -> bool:
+        if self.pattern is None:
+            return self.fallback in content_lower
+        return self.pattern.search(content_lower) is not None
+
+
+class KeywordEngine:
+    """某一版本全部关键词的预编译匹配器。
+
+    字面关键词以及通配关键词拆出的各个片段一起放进同一个自动机，
+    扫描一遍文本即可得到命中的字面关键词；通配关键词只有在所有片段都出现时
+    才用预编译好的正则确认一次。返回值是命中的小写关键词集合。
+    """
+
+    __slots__ = ("_literals", "_by_segment", "_always", "_automaton", "_patterns")
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        literals: Set[str] = set()
+        wildcards: Dict[str, _Wildcard] = {}
+        always: Set[str] = set()
+        for keyword in keywords:
+            lowered = keyword.lower()
+            if "*" not in lowered:
+                literals.add(lowered)
+            elif lowered not in wildcards:
+                wildcard = _Wildcard(lowered)
+                if wildcard.pattern is not None and not wildcard.segments:
+                    always.add(lowered)
+                else:
+                    wildcards[lowered] = wildcard
+
+        # 每个通配关键词挂在它最长的片段下，只有该片段出现时才需要进一步检查
+        patterns = set(literals)
+        by_segment: Dict[str, List[Tuple[str, _Wildcard]]] = {}
+        for lowered, wildcard in wildcards.items():
+            if wildcard.pattern is None:
+                anchor = wildcard.fallback
+            else:
+                patterns.update(wildcard.segments)
+                anchor = max(wildcard.segments, key=len)
+            patterns.add(anchor)
+            by_segment.setdefault(anchor, []).append((lowered, wildcard))
+
+        self._literals: FrozenSet[str] = frozenset(literals)
+        self._by_segment = {anchor: tuple(items) for anchor, items in by_segment.items()}
+        self._always: FrozenSet[str] = frozenset(always)
+        self._automaton: Optional[AhoCorasick] = None
+        self._patterns: Tuple[str, ...] = ()
+        if len(patterns) >= AC_MIN_PATTERNS:
+            self._automaton = AhoCorasick(patterns)
+        else:
+            self._patterns = tuple(patterns)
+
+    def _present(self, content_lower: str) -> Set[str]:
+        if self._automaton is not None:
+            return self._automaton.search(content_lower)
+        return {p for p in self._patterns if p in content_lower}
+
+    def hits(self, content_lower: str) -> Set[str]:
+        present = self._present(content_lower)
+        found = present & self._literals
+        found.update(self._always)
+        by_segment = self._by_segment
+        if by_segment:
+            for anchor in present:
+                for lowered, wildcard in by_segment.get(anchor, ()):
+                    if wildcard.pattern is None:
+                        found.add(lowered)
+                    elif all(seg in present for seg in wildcard.segments) and wildcard.hit(content_lower):
+                        found.add(lowered)
+        return found
+
+
+class KeywordError(ValueError):
+    """/watch 关键词语法错误，消息可直接回复给用户。"""
+
+
+class Term(NamedTuple):
+    """规则里的一个关键词。
+
+    普通关键词（不区分大小写、可含 *）交给 KeywordEngine 统一扫描，lowered
+    即它在引擎命中集合里的键；其余写法编译成 pattern，或在区分大小写时
+    用 text 做子串判断。
+    """
+
+    label: str
+    lowered: Optional[str] = None
+    pattern: Optional[Pattern[str]] = None
+    text: Optional[str] = None
+    # pattern 只在 content[:endpos] 里查找，用于限制 re: 正则的耗时
+    endpos: int = sys.maxsize
+
+    def hit(self, content: str, hits: Set[str]) -> bool:
+        if self.lowered is not None:
+            return self.lowered in hits
+        if self.pattern is not None:
+            return self.pattern.search(content, 0, self.endpos) is not None
+        return self.text is not None and self.text in content
+
+
+class Query(NamedTuple):
+    """带 +/- 或 re:/w:/cs: 前缀的规则：任一普通词命中、全部 + 词命中、没有 - 词命中。"""
+
+    any_of: Tuple[Term, ...]
+    all_of: Tuple[Term, ...]
+    none_of: Tuple[Term, ...]
+    lowered: Tuple[str, ...]
+
+    def matches(self, content: str, hits: Set[str]) -> List[str]:
+        """返回命中的关键词（不含 - 词）；不匹配时返回空列表。"""
+        for term in self.none_of:
+            if term.hit(content, hits):
+                return []
+        found = []
+        for term in self.all_of:
+            if not term.hit(content, hits):
+                return []
+            found.append(term.label)
+        if self.any_of:
+            any_hit = [term.label for term in self.any_of if term.hit(content, hits)]
+            if not any_hit:
+                return []
+            found.extend(any_hit)
+        return found
+
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)}
+
+
+def _check_regex(pattern: str) -> None:
+    """拒绝可能导致灾难性回溯的正则。
+
+    长度可变的重复（*、+、?、{m,n}）整个正则里最多一处，且不能套在其他重复里；
+    重复里不能有分支（单个字符的多选请写成 [ab]），也不能用反向引用。这样同一段
+    文本只有一种切分方式，如 .*.*x、a?a?b、(?:a?){10}b、(\w|a)*b 都会被拒绝。
+
+    Python 的 re 没有超时，这里在添加规则时就把危险写法挡掉，匹配时再用
+    REGEX_MAX_TEXT 限制查找范围，保证任何一个管理员的规则都不会拖住所有人的匹配。
+    """
+    if len(pattern) > REGEX_MAX_LENGTH:
+        raise KeywordError(f"正则过长（最多 {REGEX_MAX_LENGTH} 个字符）")
+    try:
+        tree = sre_parse.parse(pattern)
+    except re.error as exc:
+        raise KeywordError(f"正则无效：{exc}") from None
+
+    variable_repeats = 0
+
+    def walk(items: Sequence, in_repeat: bool) -> None:
+        nonlocal variable_repeats
+        for op, av in items:
+            if op in _REPEATS:
+                low, high, sub = av
+                if high != sre_parse.MAXREPEAT and high > REGEX_MAX_REPEAT or low > REGEX_MAX_REPEAT:
+                    raise KeywordError(f"正则重复次数过大（最多 {REGEX_MAX_REPEAT}）")
+                if high > low:
+                    if in_repeat:
+                        raise KeywordError("正则不允许嵌套重复，例如 (a+)+、(?:a?){10}")
+                    variable_repeats += 1
+                    if variable_repeats > 1:
+                        raise KeywordError("正则里最多只能有一处 *、+、? 或 {m,n} 这样长度可变的重复，例如不允许 .*.*x")
+                walk(sub, in_repeat or high > 1)
+            elif op is sre_parse.BRANCH:
+                if in_repeat:
+                    raise KeywordError("正则不允许在重复里使用分支，例如 (ab|a)*；单个字符请写成 [ab]*")
+                for branch in av[1]:
+                    walk(branch, in_repeat)
+            elif op is sre_parse.SUBPATTERN:
+                walk(av[-1], in_repeat)
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                walk(av[1], in_repeat)
+            elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+                walk(av, in_repeat)
+            elif op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                raise KeywordError("正则不允许反向引用")
+
+    walk(list(tree), False)
+
+
+def _glob(body: str) -> str:
+    return re.escape(body).replace("\\*", ".*")
+
+
+def _split_prefixes(token: str) -> Tuple[str, str, bool, bool, bool]:
+    """拆出 [+|-] 和开头连续的 cs:/w:/re: 前缀，返回 (符号, 关键词本体, cs, w, re)。"""
+    sign = ""
+    body = token
+    if len(body) > 1 and body[0] in "+-":
+        sign, body = body[0], body[1:]
+    case_sensitive = whole_word = regex = False
+    while not regex:
+        lowered = body.lower()
+        if lowered.startswith("cs:") and not case_sensitive:
+            case_sensitive, body = True, body[3:]
+        elif lowered.startswith("w:") and not whole_word:
+            whole_word, body = True, body[2:]
+        elif lowered.startswith("re:"):
+            regex, body = True, body[3:]
+        else:
+            break
+    return sign, body, case_sensitive, whole_word, regex
+
+
+def is_case_sensitive(token: str) -> bool:
+    """关键词是否区分大小写（cs: 或 re: 写法）；用于按原样而不是按小写去重。"""
+    _, _, case_sensitive, _, regex = _split_prefixes(token)
+    return case_sensitive or regex
+
+
+def parse_term(token: str) -> Tuple[str, Term]:
+    """解析单个关键词，返回 (符号, Term)，符号为 ""、"+" 或 "-"。
+
+    写法：[+|-][cs:][w:]关键词 或 [+|-][cs:][w:]re:正则
+      +词  必须同时出现；-词  出现则不提醒
+      cs:  区分大小写；w:  整词匹配（前后不能紧挨字母数字，中日韩文字不算）；re:  正则（之后的内容原样作为正则）
+    """
+    sign, body, case_sensitive, whole_word, regex = _split_prefixes(token)
+    if not body:
+        raise KeywordError(f"关键词 {token} 为空")
+
+    label = token[1:] if sign else token
+    if not (case_sensitive or whole_word or regex):
+        return sign, Term(label, lowered=body.lower())
+    endpos = sys.maxsize
+    if regex:
+        _check_regex(body)
+        source = body
+        endpos = REGEX_MAX_TEXT
+    else:
+        source = _glob(body) if "*" in body else re.escape(body)
+    if whole_word:
+        source = f"(?<!{_WORD_CHAR})(?:{source})(?!{_WORD_CHAR})"
+    elif case_sensitive and not regex and "*" not in body:
+        return sign, Term(label, text=body)
+    try:
+        pattern = re.compile(source, 0 if case_sensitive else re.IGNORECASE)
+    except re.error as exc:
+        raise KeywordError(f"关键词 {token} 无效：{exc}") from None
+    return sign, Term(label, pattern=pattern, endpos=endpos)
+
+
+@lru_cache(maxsize=65536)
+def compile_query(keywords: Tuple[str, ...]) -> Optional[Query]:
+    """把一条规则的关键词编译成 Query；全是普通关键词时返回 None，走原来的快速路径。
+
+    同样的关键词组合只编译一次。语法错误抛 KeywordError。
+    """
+    any_of: List[Term] = []
+    all_of: List[Term] = []
+    none_of: List[Term] = []
+    plain = True
+    for keyword in keywords:
+        sign, term = parse_term(keyword)
+        if sign or term.lowered is None:
+            plain = False
+        {"": any_of, "+": all_of, "-": none_of}[sign].append(term)
+    if not any_of and not all_of:
+        raise KeywordError("至少需要一个不带 - 的关键词")
+    if plain:
+        return None
+    lowered = tuple(term.lowered for term in any_of + all_of + none_of if term.lowered is not None)
+    return Query(tuple(any_of), tuple(all_of), tuple(none_of), lowered)
@@ -0,0 +1,97 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+# 作为 extra 传入、需要单独输出的结构化字段
+FIELDS = ("chat_id", "msg_id", "owner", "rule", "target", "session", "latency")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """text：时间 等级 模块 消息 key=value...；json：每条一行 JSON。"""
+
+    def __init__(self, fmt: str = "text") -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.json = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {name: getattr(record, name) for name in FIELDS if getattr(record, name, None) is not None}
+        if isinstance(fields.get("latency"), float):
+            fields["latency"] = round(fields["latency"], 4)
+        if self.json:
+            payload = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """同一条警告（同一模板、同一群/目标）在 interval 秒内只输出一次。
+
+    被抑制的次数在下一次输出时附在消息末尾。只作用于 WARNING 及以上。
+    """
+
+    def __init__(self, interval: float = 300.0) -> None:
+        super().__init__()
+        self.interval = interval
+        self._last: Dict[Tuple, Tuple[float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.interval <= 0:
+            return True
+        key = (record.name, record.msg, getattr(record, "chat_id", None), getattr(record, "target", None))
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last[0] < self.interval:
+            self._last[key] = (last[0], last[1] + 1)
+            return False
+        if last is not None and last[1]:
+            record.msg = f"{record.msg}（此前 {self.interval:g} 秒内已抑制 {last[1]} 条）"
+        self._last[key] = (now, 0)
+        if len(self._last) > 10000:
+            self._last = {k: v for k, v in self._last.items() if now - v[0] < self.interval}
+        return True
+
+
+def setup(level: str = "INFO", fmt: str = "text", rate_limit: float = 300.0) -> None:
+    """配置根 logger：调用方只把记录放进内存队列，由后台线程格式化并写 stderr。"""
+    global _listener
+    shutdown()
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter(rate_limit))
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(StructuredFormatter(fmt))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    # Pyrogram 自身的 INFO 日志很多，只保留警告
+    logging.getLogger("pyrogram").setLevel(max(root.level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown() -> None:
+    """停止后台线程，先把队列里剩余的日志写完。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,55 +1,74 @@
 import asyncio
-import json
+import io
+import logging
+import os
 import re
-from collections import deque
+import socket
+import sqlite3
+import time
 from contextlib import suppress
-from pathlib import Path
-from typing import Any, Deque, Dict, List, Set
+from typing import Any, Dict, Iterable, List, Tuple
 
 from pyrogram import Client, filters, idle
-from pyrogram.errors import RPCError
 from pyrogram.handlers import MessageHandler
 
 import config
+import log
+import metrics
+from bus import MessageEvent, open_bus
+from dedup import DedupCache
+from delivery import MESSAGE_LIMIT, Notification, Notifier
+from extract import ContentExtractor
+from keywords import KeywordError, compile_query, is_case_sensitive
+from matcher import RulesSnapshot
+from matchpool import MatchPool
+from normalize import Normalizer
+from peers import Peer, PeerCache, PeerError, parse_ref
+from poller import Poller
+from profiler import RuleProfiler, RuleStats
+from scheduler import PollScheduler
+from sharding import SessionPool, session_name
+from storage import Store, migrate_json, rule_key
 
 DATA_LOCK = asyncio.Lock()
 DATA_CACHE: Dict[str, Any] = {"users": {}}
+# 只在持有 DATA_LOCK 修改 DATA_CACHE 后整体替换；读取方无需加锁
+RULES = RulesSnapshot.build(DATA_CACHE)
 
 bot_client: Client | None = None
-user_client: Client | None = None
-
-PROCESSED_ORDER: Dict[int, Deque[int]] = {}
-PROCESSED_SEEN: Dict[int, Set[int]] = {}
-MAX_PROCESSED_PER_CHAT = 1000
+# 所有 userbot 会话；轮询按一致性哈希分给其中健康的会话
+SESSIONS = SessionPool(max_failures=config.SESSION_MAX_FAILURES, retry_after=config.SESSION_RETRY_AFTER)
+NOTIFIER: Notifier | None = None
+STORE: Store | None = None
+# ingest/worker 模式下的消息队列；为 None（all 模式）时在本进程内直接匹配
+BUS = None
+
+# 转换表在启动时一次性构建，消息和新加的关键词都经过它
+NORMALIZER = Normalizer(config.NORMALIZE_TEXT)
+# 每条消息的可搜索文本（正文、按钮、转发来源等），实时和轮询两条路径共用
+EXTRACTOR = ContentExtractor(maxsize=config.EXTRACT_CACHE_SIZE)
+# 规则开销统计，默认关闭，由超管用 /profile on 开启
+PROFILER = RuleProfiler(enabled=config.PROFILE_RULES)
+# 规则多或消息长时把匹配交给子进程；MATCH_WORKERS=0 时全部在事件循环里匹配
+MATCHER = MatchPool(
+    NORMALIZER,
+    workers=config.MATCH_WORKERS,
+    min_rules=config.MATCH_POOL_MIN_RULES,
+    min_chars=config.MATCH_POOL_MIN_CHARS,
+    batch_size=config.MATCH_BATCH_SIZE,
+    batch_delay=config.MATCH_BATCH_DELAY,
+    profiler=PROFILER,
+)
+
+DEDUP = DedupCache(window=config.DEDUP_WINDOW, max_chats=config.DEDUP_MAX_CHATS)
 POLL_INTERVAL_SECONDS = 10
 
 ADMINS_CACHE: List[int] = []
 
+# 用户名/链接解析结果与群名，持久化在数据库里，后台定期刷新
+PEERS = PeerCache(ttl=config.PEER_CACHE_TTL)
 
-def _ensure_rules_file(path: Path) -> None:
-    if not path.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps({"users": {}}, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
-def _load_data(path: Path) -> Dict[str, Any]:
-    _ensure_rules_file(path)
-    raw = path.read_text(encoding="utf-8")
-    if not raw.strip():
-        return {"users": {}}
-    try:
-        data = json.loads(raw)
-        if "users" not in data or not isinstance(data["users"], dict):
-            return {"users": {}}
-        return data
-    except json.JSONDecodeError:
-        return {"users": {}}
-
-
-def _save_data(path: Path, data: Dict[str, Any]) -> None:
-    tmp_path = path.with_suffix(".tmp")
-    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp_path.replace(path)
+logger = logging.getLogger("monitor")
 
 
 def _get_user_bucket(data: Dict[str, Any], owner_id: int) -> Dict[str, Any]:
@@ -66,38 +85,27 @@ def _get_user_bucket(data: Dict[str, Any], owner_id: int) -> Dict[str, Any]:
     return bucket
 
 
+def _describe_digest(bucket: Dict[str, Any]) -> str:
+    window = int(bucket.get("notify_digest", 0) or 0)
+    return f"汇总（每 {window} 秒合并发送）" if window > 0 else "即时"
+
+
 def _normalize_keywords(keywords: List[str]) -> List[str]:
     seen = set()
     result = []
     for kw in keywords:
-        kw = kw.strip()
+        kw = NORMALIZER(kw).strip()
         if not kw:
             continue
-        lowered = kw.lower()
-        if lowered in seen:
+        # 区分大小写的写法和正则按原样去重
+        key = kw if is_case_sensitive(kw) else kw.lower()
+        if key in seen:
             continue
-        seen.add(lowered)
+        seen.add(key)
         result.append(kw)
     return result
 
 
-def _load_admins() -> List[int]:
-    if not config.ADMINS_PATH.exists():
-        return []
-    try:
-        data = json.loads(config.ADMINS_PATH.read_text(encoding="utf-8"))
-        return data.get("admins", [])
-    except Exception:
-        return []
-
-
-def _save_admins(admins: List[int]) -> None:
-    config.ADMINS_PATH.write_text(
-        json.dumps({"admins": admins}, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
-
-
 def _get_all_admins() -> List[int]:
     return list(set(config.SUPER_ADMIN_IDS + ADMINS_CACHE))
 
@@ -114,103 +122,270 @@ def _is_super_admin(user_id: int) -> bool:
 
 
 def _remember_message(chat_id: int, msg_id: int) -> bool:
-    order = PROCESSED_ORDER.setdefault(chat_id, deque())
-    seen = PROCESSED_SEEN.setdefault(chat_id, set())
-    if msg_id in seen:
-        return False
-    order.append(msg_id)
-    seen.add(msg_id)
-    while len(order) > MAX_PROCESSED_PER_CHAT:
-        oldest = order.popleft()
-        seen.discard(oldest)
-    return True
+    return DEDUP.remember(chat_id, msg_id)
 
 
-def _keyword_hit(content_lower: str, keyword: str) -> bool:
-    if keyword == "*":
-        return True
-    lowered = keyword.lower()
-    if "*" not in lowered:
-        return lowered in content_lower
-    pattern = re.escape(lowered).replace("\\*", ".*")
-    try:
-        return re.search(pattern, content_lower) is not None
-    except re.error:
-        return lowered.replace("*", "") in content_lower
+def _publish_owner(owner_id: int, bucket: Dict[str, Any]) -> None:
+    global RULES
+    RULES = RULES.with_owner(str(owner_id), bucket)
 
 
-async def cmd_watch(client: Client, message) -> None:
-    if not message.from_user or not _check_admin(message.from_user.id):
-        return
-    args = message.text.split()
-    if len(args) < 4:
-        await message.reply_text("用法：/watch 群ID|* 用户ID|* 关键词|*\n* 表示匹配所有")
-        return
+def _resolver() -> Tuple[Client, str | None] | None:
+    """用于解析用户名的客户端：优先用健康的 userbot 会话，其次用 bot。"""
+    for session in SESSIONS:
+        if session.up:
+            return session.client, session.name
+    return (bot_client, None) if bot_client is not None else None
 
-    group_id = None
-    if args[1] != "*":
+
+async def _resolve_groups(refs: Iterable[str]) -> Dict[str, int | str]:
+    """把规则里的群写法（群ID、t.me 链接、@用户名）解析成群ID；解析失败时值为错误说明。"""
+    resolved: Dict[str, int | str] = {}
+    for ref in set(refs) - {"*"}:
         try:
-            group_id = int(args[1])
-        except ValueError:
-            await message.reply_text("群ID 必须是数字或 *")
-            return
+            parsed = parse_ref(ref)
+            if isinstance(parsed, str):
+                resolver = _resolver()
+                if resolver is None:
+                    raise PeerError("没有可用的客户端来解析用户名，请改用群ID")
+                parsed = (await PEERS.resolve(resolver[0], parsed, resolver[1])).chat_id
+        except PeerError as exc:
+            resolved[ref] = str(exc)
+        else:
+            resolved[ref] = parsed
+    await _save_peers()
+    return resolved
+
+
+def _group_refs(lines: Iterable[str]) -> List[str]:
+    refs = []
+    for line in lines:
+        tokens = line.split(maxsplit=1)
+        if tokens and not tokens[0].startswith("#"):
+            refs.append(tokens[0])
+    return refs
+
+
+def _parse_rule(tokens: List[str], groups: Dict[str, int | str]) -> Tuple[Dict[str, Any] | None, str]:
+    """把 群|* 用户ID|* 关键词... 解析成规则；出错时返回 (None, 错误说明)。
+
+    groups 是 _resolve_groups 对群写法的解析结果。
+    """
+    if len(tokens) < 3:
+        return None, "格式应为：群ID|链接|* 用户ID|* 关键词|*"
+
+    group_id = None
+    if tokens[0] != "*":
+        group_id = groups.get(tokens[0])
+        if not isinstance(group_id, int):
+            return None, group_id or "群ID 必须是数字、链接或 *"
 
     user_id = None
-    if args[2] != "*":
+    if tokens[1] != "*":
         try:
-            user_id = int(args[2])
+            user_id = int(tokens[1])
         except ValueError:
-            await message.reply_text("用户ID 必须是数字或 *")
-            return
+            return None, "用户ID 必须是数字或 *"
 
-    if args[3] == "*":
+    if tokens[2:] == ["*"]:
         keywords = ["*"]
     else:
-        keywords = _normalize_keywords(args[3:])
+        keywords = _normalize_keywords(tokens[2:])
         if not keywords:
-            await message.reply_text("请提供至少一个关键词或 *")
-            return
+            return None, "请提供至少一个关键词或 *"
+        try:
+            compile_query(tuple(keywords))
+        except KeywordError as exc:
+            return None, f"关键词有误：{exc}"
+    return {"group_id": group_id, "user_id": user_id, "keywords": keywords}, ""
+
+
+async def _parse_rules_text(lines: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """每行一条规则，空行和 # 开头的行忽略；返回 (规则列表, 出错行的说明)。"""
+    groups = await _resolve_groups(_group_refs(lines))
+    rules: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for lineno, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        rule, error = _parse_rule(line.split(), groups)
+        if rule is None:
+            errors.append(f"第 {lineno} 行：{error}")
+        else:
+            rules.append(rule)
+    return rules, errors
 
-    owner_id = message.from_user.id
+
+def _format_rule(rule: Dict[str, Any]) -> str:
+    gid = rule["group_id"] if rule["group_id"] is not None else "*"
+    uid = rule["user_id"] if rule["user_id"] is not None else "*"
+    return f"{gid} {uid} {' '.join(rule['keywords'])}"
+
+
+async def _add_rules(owner_id: int, rules: List[Dict[str, Any]]) -> int:
+    """批量添加规则，按规则哈希键去重，整批只写一次数据库；返回实际新增的条数。"""
+    global RULES
     async with DATA_LOCK:
         bucket = _get_user_bucket(DATA_CACHE, owner_id)
-        for rule in bucket["rules"]:
-            if rule["group_id"] == group_id and rule["user_id"] == user_id and rule["keywords"] == keywords:
-                await message.reply_text("规则已存在，无需重复添加。")
-                return
-        bucket["rules"].append({"group_id": group_id, "user_id": user_id, "keywords": keywords})
-        _save_data(config.RULES_PATH, DATA_CACHE)
+        seen = {rule_key(rule) for rule in bucket["rules"]}
+        fresh = []
+        for rule in rules:
+            key = rule_key(rule)
+            if key not in seen:
+                seen.add(key)
+                fresh.append(rule)
+        if fresh:
+            bucket["rules"].extend(fresh)
+            RULES = RULES.with_rules_added(str(owner_id), fresh)
+            await STORE.run(STORE.add_rules, owner_id, fresh)
+    return len(fresh)
+
+
+async def _reply_bulk(message, rules: List[Dict[str, Any]], errors: List[str]) -> None:
+    if len(rules) > config.BULK_MAX_RULES:
+        await message.reply_text(f"一次最多添加 {config.BULK_MAX_RULES} 条规则，当前 {len(rules)} 条")
+        return
+    added = await _add_rules(message.from_user.id, rules) if rules else 0
+    lines = [f"✅ 新增 {added} 条规则，跳过重复 {len(rules) - added} 条。"]
+    if errors:
+        lines.append(f"以下 {len(errors)} 行有误，未添加：")
+        lines.extend(errors[:20])
+        if len(errors) > 20:
+            lines.append(f"……另有 {len(errors) - 20} 行")
+    await message.reply_text("\n".join(lines))
 
+
+async def cmd_watch(client: Client, message) -> None:
+    if not message.from_user or not _check_admin(message.from_user.id):
+        return
+    # 第一行是命令本身，之后每行一条规则，可以一次添加多条
+    lines = message.text.split("\n")
+    first = lines[0].split(maxsplit=1)
+    # 出错行号从第一行规则数起；/watch 后面同一行没写规则时，命令行本身不计
+    if len(first) > 1:
+        lines[0] = first[1]
+    else:
+        lines = lines[1:]
+    entries = [line for line in lines if line.strip() and not line.strip().startswith("#")]
+    if len(entries) > 1:
+        rules, errors = await _parse_rules_text(lines)
+        await _reply_bulk(message, rules, errors)
+        return
+
+    tokens = entries[0].split() if entries else []
+    if len(tokens) < 3:
+        await message.reply_text(
+            "用法：/watch 群ID|链接|* 用户ID|* 关键词|*\n* 表示匹配所有，关键词写法见 /help\n"
+            "换行写多条规则可一次添加多条"
+        )
+        return
+    rule, error = _parse_rule(tokens, await _resolve_groups(tokens[:1]))
+    if rule is None:
+        await message.reply_text(error)
+        return
+    if not await _add_rules(message.from_user.id, [rule]):
+        await message.reply_text("规则已存在，无需重复添加。")
+        return
     await message.reply_text("✅ 已添加监听规则。")
 
 
+async def cmd_import(client: Client, message) -> None:
+    if not message.from_user or not _check_admin(message.from_user.id):
+        return
+    # 规则文件可以附在 /import 消息上，也可以回复一条带文件的消息
+    source = message if message.document else message.reply_to_message
+    if source is None or source.document is None:
+        await message.reply_text(
+            "用法：发送规则文件并在说明里写 /import，或回复规则文件发送 /import\n"
+            "文件每行一条规则（群ID|* 用户ID|* 关键词...），格式与 /export 导出的相同"
+        )
+        return
+    if (source.document.file_size or 0) > config.IMPORT_MAX_BYTES:
+        await message.reply_text(f"文件过大，最多 {config.IMPORT_MAX_BYTES // 1024} KB")
+        return
+    buffer = await client.download_media(source, in_memory=True)
+    try:
+        text = bytes(buffer.getbuffer()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await message.reply_text("文件不是 UTF-8 文本")
+        return
+    rules, errors = await _parse_rules_text(text.splitlines())
+    if not rules and not errors:
+        await message.reply_text("文件里没有规则")
+        return
+    await _reply_bulk(message, rules, errors)
+
+
+async def cmd_export(client: Client, message) -> None:
+    if not message.from_user or not _check_admin(message.from_user.id):
+        return
+    owner_id = message.from_user.id
+    async with DATA_LOCK:
+        rules = list(_get_user_bucket(DATA_CACHE, owner_id)["rules"])
+    if not rules:
+        await message.reply_text("当前没有任何规则。")
+        return
+    lines = ["# 每行一条规则：群ID|* 用户ID|* 关键词...，可用 /import 导入"]
+    lines.extend(_format_rule(rule) for rule in rules)
+    document = io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+    document.name = f"rules-{owner_id}.txt"
+    await message.reply_document(document, caption=f"共 {len(rules)} 条规则")
+
+
+def _parse_indices(text: str) -> List[Tuple[int, int]] | None:
+    """解析 "1 3-5,8" 这样的序号列表，返回闭区间列表；格式不对时返回 None。"""
+    ranges = []
+    for token in re.split(r"[,，、\s]+", text.strip()):
+        if not token:
+            continue
+        start, sep, end = token.partition("-")
+        try:
+            first = int(start)
+            last = int(end) if sep else first
+        except ValueError:
+            return None
+        ranges.append((min(first, last), max(first, last)))
+    return ranges or None
+
+
 async def cmd_unwatch(client: Client, message) -> None:
+    global RULES
     if not message.from_user or not _check_admin(message.from_user.id):
         return
-    args = message.text.split()
+    args = message.text.split(maxsplit=1)
     if len(args) != 2:
-        await message.reply_text("用法：/unwatch 序号\n例如：/unwatch 1")
+        await message.reply_text("用法：/unwatch 序号\n例如：/unwatch 1、/unwatch 1-5,8")
         return
 
-    try:
-        idx = int(args[1])
-    except ValueError:
-        await message.reply_text("序号必须是数字")
+    ranges = _parse_indices(args[1])
+    if ranges is None:
+        await message.reply_text("序号必须是数字或范围，如 3 或 1-5")
         return
 
     owner_id = message.from_user.id
     async with DATA_LOCK:
         bucket = _get_user_bucket(DATA_CACHE, owner_id)
-        if idx < 1 or idx > len(bucket["rules"]):
-            await message.reply_text(f"序号无效，当前共 {len(bucket['rules'])} 条规则")
+        total = len(bucket["rules"])
+        if any(first < 1 or last > total for first, last in ranges):
+            await message.reply_text(f"序号无效，当前共 {total} 条规则")
             return
-        removed = bucket["rules"].pop(idx - 1)
-        _save_data(config.RULES_PATH, DATA_CACHE)
-
-    gid = removed["group_id"] if removed["group_id"] is not None else "*"
-    uid = removed["user_id"] if removed["user_id"] is not None else "*"
-    kws = "、".join(removed["keywords"])
-    await message.reply_text(f"✅ 已删除规则 {idx}：\n群={gid} 用户={uid} 关键词={kws}")
+        drop = set()
+        for first, last in ranges:
+            drop.update(range(first, last + 1))
+        removed = [rule for idx, rule in enumerate(bucket["rules"], start=1) if idx in drop]
+        bucket["rules"][:] = [rule for idx, rule in enumerate(bucket["rules"], start=1) if idx not in drop]
+        RULES = RULES.with_rules_removed(str(owner_id), removed)
+        await STORE.run(STORE.remove_rules, owner_id, removed)
+
+    if len(removed) > 1:
+        await message.reply_text(f"✅ 已删除 {len(removed)} 条规则。")
+        return
+    rule = removed[0]
+    gid = rule["group_id"] if rule["group_id"] is not None else "*"
+    uid = rule["user_id"] if rule["user_id"] is not None else "*"
+    kws = "、".join(rule["keywords"])
+    await message.reply_text(f"✅ 已删除规则 {min(drop)}：\n群={gid} 用户={uid} 关键词={kws}")
 
 
 async def cmd_list(client: Client, message) -> None:
@@ -220,7 +395,8 @@ async def cmd_list(client: Client, message) -> None:
     async with DATA_LOCK:
         bucket = _get_user_bucket(DATA_CACHE, owner_id)
         rules = list(bucket["rules"])
-        notify_targets = bucket.get("notify_targets", [])
+        notify_targets = list(bucket.get("notify_targets", []))
+        notify_mode = _describe_digest(bucket)
 
     if not rules:
         await message.reply_text("当前没有任何规则。")
@@ -231,13 +407,23 @@ async def cmd_list(client: Client, message) -> None:
         kws = "、".join(rule["keywords"]) if rule["keywords"] != ["*"] else "*"
         gid = rule["group_id"] if rule["group_id"] is not None else "*"
         uid = rule["user_id"] if rule["user_id"] is not None else "*"
+        peer = PEERS.get(rule["group_id"]) if rule["group_id"] is not None else None
+        if peer is not None and peer.title:
+            gid = f"{gid}（{peer.title}）"
         lines.append(f"{idx}. 群={gid} 用户={uid} 关键词={kws}")
-    notify_targets = bucket.get("notify_targets", [])
     if notify_targets:
         lines.append(f"通知目标：{', '.join(str(t) for t in notify_targets)}")
     else:
         lines.append("通知目标：未设置（默认发送给你）")
-    await message.reply_text("\n".join(lines))
+    lines.append(f"通知方式：{notify_mode}")
+    text = "\n".join(lines)
+    if len(text) <= MESSAGE_LIMIT:
+        await message.reply_text(text)
+        return
+    # 规则多时一条消息放不下，改为发送文件，序号与 /unwatch 一致
+    document = io.BytesIO((text + "\n").encode("utf-8"))
+    document.name = f"list-{owner_id}.txt"
+    await message.reply_document(document, caption=f"共 {len(rules)} 条规则，超出单条消息长度，已作为文件发送")
 
 
 async def cmd_notify(client: Client, message) -> None:
@@ -245,7 +431,7 @@ async def cmd_notify(client: Client, message) -> None:
         return
     args = message.text.split()
     if len(args) < 2:
-        await message.reply_text("用法：\n/notify add 目标ID - 添加通知目标\n/notify del 目标ID - 删除通知目标\n/notify list - 查看所有通知目标\n/notify clear - 清空所有通知目标")
+        await message.reply_text("用法：\n/notify add 目标ID - 添加通知目标\n/notify del 目标ID - 删除通知目标\n/notify list - 查看所有通知目标\n/notify clear - 清空所有通知目标\n/notify digest 秒数|off - 设置汇总发送")
         return
 
     action = args[1].lower()
@@ -255,20 +441,46 @@ async def cmd_notify(client: Client, message) -> None:
         async with DATA_LOCK:
             bucket = _get_user_bucket(DATA_CACHE, owner_id)
             targets = bucket.get("notify_targets", [])
+            notify_mode = _describe_digest(bucket)
         if not targets:
-            await message.reply_text("当前没有设置通知目标（默认发送给你）")
+            await message.reply_text(f"当前没有设置通知目标（默认发送给你）\n通知方式：{notify_mode}")
         else:
             lines = ["📌 当前通知目标："]
             for i, t in enumerate(targets, 1):
                 lines.append(f"  {i}. {t}")
+            lines.append(f"通知方式：{notify_mode}")
             await message.reply_text("\n".join(lines))
         return
 
+    if action == "digest":
+        if len(args) < 3:
+            await message.reply_text("用法：/notify digest 秒数|off\n例如：/notify digest 60 - 60 秒内的提醒合并成一条")
+            return
+        if args[2].lower() in ("off", "0"):
+            window = 0
+        else:
+            try:
+                window = int(args[2])
+            except ValueError:
+                await message.reply_text("秒数必须是数字或 off")
+                return
+            if window < 0 or window > config.NOTIFY_DIGEST_MAX_WINDOW:
+                await message.reply_text(f"秒数必须在 1~{config.NOTIFY_DIGEST_MAX_WINDOW} 之间")
+                return
+        async with DATA_LOCK:
+            bucket = _get_user_bucket(DATA_CACHE, owner_id)
+            bucket["notify_digest"] = window
+            _publish_owner(owner_id, bucket)
+            await STORE.run(STORE.set_notify_digest, owner_id, window)
+        await message.reply_text(f"✅ 通知方式已设为：{_describe_digest(bucket)}")
+        return
+
     if action == "clear":
         async with DATA_LOCK:
             bucket = _get_user_bucket(DATA_CACHE, owner_id)
             bucket["notify_targets"] = []
-            _save_data(config.RULES_PATH, DATA_CACHE)
+            _publish_owner(owner_id, bucket)
+            await STORE.run(STORE.clear_notify_targets, owner_id)
         await message.reply_text("✅ 已清空所有通知目标。")
         return
 
@@ -288,7 +500,8 @@ async def cmd_notify(client: Client, message) -> None:
                 await message.reply_text("该目标已存在。")
                 return
             bucket["notify_targets"].append(target_id)
-            _save_data(config.RULES_PATH, DATA_CACHE)
+            _publish_owner(owner_id, bucket)
+            await STORE.run(STORE.add_notify_target, owner_id, target_id)
         await message.reply_text(f"✅ 已添加通知目标：{target_id}")
 
     elif action == "del":
@@ -303,7 +516,8 @@ async def cmd_notify(client: Client, message) -> None:
                 await message.reply_text("该目标不存在。")
                 return
             bucket["notify_targets"].remove(target_id)
-            _save_data(config.RULES_PATH, DATA_CACHE)
+            _publish_owner(owner_id, bucket)
+            await STORE.run(STORE.remove_notify_target, owner_id, target_id)
         await message.reply_text(f"✅ 已删除通知目标：{target_id}")
 
     else:
@@ -311,13 +525,14 @@ async def cmd_notify(client: Client, message) -> None:
         try:
             target_id = int(args[1])
         except ValueError:
-            await message.reply_text("未知操作，请使用 add/del/list/clear")
+            await message.reply_text("未知操作，请使用 add/del/list/clear/digest")
             return
         async with DATA_LOCK:
             bucket = _get_user_bucket(DATA_CACHE, owner_id)
             if target_id not in bucket["notify_targets"]:
                 bucket["notify_targets"].append(target_id)
-            _save_data(config.RULES_PATH, DATA_CACHE)
+            _publish_owner(owner_id, bucket)
+            await STORE.run(STORE.add_notify_target, owner_id, target_id)
         await message.reply_text(f"✅ 已添加通知目标：{target_id}")
 
 
@@ -361,7 +576,7 @@ async def cmd_admin(client: Client, message) -> None:
             await message.reply_text("该用户已是管理员")
             return
         ADMINS_CACHE.append(target_id)
-        _save_admins(ADMINS_CACHE)
+        await STORE.run(STORE.add_admin, target_id)
         await message.reply_text(f"✅ 已添加管理员：{target_id}")
     elif action == "del":
         if target_id in config.SUPER_ADMIN_IDS:
@@ -371,12 +586,144 @@ async def cmd_admin(client: Client, message) -> None:
             await message.reply_text("该用户不是管理员")
             return
         ADMINS_CACHE.remove(target_id)
-        _save_admins(ADMINS_CACHE)
+        await STORE.run(STORE.remove_admin, target_id)
         await message.reply_text(f"✅ 已删除管理员：{target_id}")
     else:
         await message.reply_text("未知操作，请使用 add/del/list")
 
 
+def _format_seconds(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "∞"
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.1f}µs"
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+
+def _render_stats() -> str:
+    live = metrics.MESSAGES_SEEN.value("live")
+    polled = metrics.MESSAGES_SEEN.value("poll")
+    hits = metrics.DEDUP_RESULTS.value("hit")
+    checked = hits + metrics.DEDUP_RESULTS.value("miss")
+    hit_rate = f"{hits / checked:.1%}" if checked else "-"
+    failures = metrics.NOTIFY_FAILURES.values()
+    failed = "、".join(f"{reason[0]}={count:g}" for reason, count in sorted(failures.items())) or "0"
+    top_owners = sorted(metrics.MATCHES.values().items(), key=lambda item: item[1], reverse=True)[:5]
+
+    def latency(histogram: metrics.Histogram) -> str:
+        if not histogram.count():
+            return "-"
+        return (
+            f"平均 {_format_seconds(histogram.mean())} / "
+            f"p50≤{_format_seconds(histogram.quantile(0.5))} / p99≤{_format_seconds(histogram.quantile(0.99))}"
+        )
+
+    lines = [
+        "📊 运行统计",
+        f"消息：实时 {live:g} 条，轮询 {polled:g} 条",
+        f"去重：命中 {hits:g}/{checked:g}（{hit_rate}），跟踪 {len(DEDUP)} 个群",
+        f"规则：{len(RULES.index)} 条（版本 {RULES.version}）",
+        f"匹配耗时：{latency(metrics.MATCH_SECONDS)}",
+        f"通知：已发送 {metrics.NOTIFY_SENT.value():g} 条，队列 {metrics.NOTIFY_QUEUE_DEPTH.value():g} 条，"
+        f"FloodWait {metrics.NOTIFY_FLOOD_WAITS.value():g} 次，失败 {failed}",
+        f"发送耗时：{latency(metrics.NOTIFY_SEND_SECONDS)}",
+        f"端到端延迟：{latency(metrics.END_TO_END_SECONDS)}",
+        f"轮询每群耗时：{latency(metrics.POLL_CHAT_SECONDS)}",
+    ]
+    if top_owners:
+        lines.append("命中最多：" + "、".join(f"{owner[0]}×{count:g}" for owner, count in top_owners))
+    for session in SESSIONS:
+        state = "正常" if session.up else f"暂停（{session.last_error or '启动失败'}）"
+        average = _format_seconds(session.busy / session.polls) if session.polls else "-"
+        lines.append(
+            f"会话 {session.name}：{state}，负责 {session.chats} 个群，轮询 {session.polls} 次"
+            f"（平均 {average}），拉到 {session.fetched} 条，失败 {session.failures}，超时 {session.timeouts}"
+        )
+    return "\n".join(lines)
+
+
+async def cmd_stats(client: Client, message) -> None:
+    if not message.from_user or not _check_admin(message.from_user.id):
+        return
+    await message.reply_text(_render_stats())
+
+
+def _format_profiled(item: RuleStats) -> str:
+    rule = _format_rule({"group_id": item.group_id, "user_id": item.user_id, "keywords": item.keywords})
+    average = _format_seconds(item.seconds / item.evaluations) if item.evaluations else "-"
+    return (
+        f"[{item.owner_id}] {rule}\n"
+        f"    检查 {item.evaluations} 次，命中 {item.hits} 次，累计 {_format_seconds(item.seconds)}，平均 {average}"
+    )
+
+
+def _render_profile(limit: int) -> str:
+    rules = list(RULES.index.rules())
+    state = "开启" if PROFILER.enabled else "关闭"
+    elapsed = time.time() - PROFILER.started
+    lines = [
+        f"🔬 规则开销统计（{state}，已统计 {_format_seconds(elapsed)}）",
+        f"消息 {PROFILER.messages} 条，关键词扫描累计 {_format_seconds(PROFILER.scan_seconds)}",
+    ]
+    top = PROFILER.top(rules, limit)
+    if top:
+        lines.append(f"\n⏱ 耗时最多的 {len(top)} 条规则：")
+        lines.extend(f"{idx}. {_format_profiled(item)}" for idx, item in enumerate(top, start=1))
+    owners = PROFILER.owners(rules)[:limit]
+    if owners:
+        lines.append("\n👤 按用户汇总：")
+        lines.extend(
+            f"{item.owner_id}：{item.rules} 条规则，检查 {item.evaluations} 次，命中 {item.hits} 次，"
+            f"累计 {_format_seconds(item.seconds)}"
+            for item in owners
+        )
+    lines.append(f"\n💤 未命中过的规则：{len(PROFILER.dead(rules))} 条（/profile dead 查看）")
+    return "\n".join(lines)
+
+
+async def cmd_profile(client: Client, message) -> None:
+    if not message.from_user or not _is_super_admin(message.from_user.id):
+        return
+    args = message.text.split()[1:]
+    if args and args[0].isdigit():
+        args.insert(0, "show")
+    action = args[0].lower() if args else "show"
+    try:
+        # 每条规则占两行，条数太多会超过单条消息长度
+        limit = min(max(1, int(args[1])), 30) if len(args) > 1 else 10
+    except ValueError:
+        await message.reply_text("数量必须是数字")
+        return
+
+    if action == "on":
+        if not PROFILER.enabled:
+            PROFILER.reset()
+            PROFILER.enabled = True
+        await message.reply_text("✅ 已开启规则开销统计；开启期间关键词匹配不交给子进程。")
+    elif action == "off":
+        PROFILER.enabled = False
+        await message.reply_text("✅ 已关闭规则开销统计，已有数据保留到下次开启。")
+    elif action == "reset":
+        PROFILER.reset()
+        await message.reply_text("✅ 统计已清零。")
+    elif action == "show":
+        await message.reply_text(_render_profile(limit))
+    elif action == "dead":
+        dead = PROFILER.dead(RULES.index.rules())
+        if not dead:
+            await message.reply_text("所有规则都命中过。")
+            return
+        lines = [f"💤 未命中过的规则 {len(dead)} 条（按被检查次数排序）："]
+        lines.extend(f"{idx}. {_format_profiled(item)}" for idx, item in enumerate(dead[:limit], start=1))
+        await message.reply_text("\n".join(lines))
+    elif action == "export":
+        document = io.BytesIO(PROFILER.export(RULES.index.rules()).encode("utf-8"))
+        document.name = f"profile-{int(time.time())}.json"
+        await message.reply_document(document, caption="规则开销统计（JSON）")
+    else:
+        await message.reply_text("用法：/profile [show|dead [数量]|on|off|reset|export]")
+
+
 async def cmd_help(client: Client, message) -> None:
     if not message.from_user or not _check_admin(message.from_user.id):
         return
@@ -384,28 +731,47 @@ async def cmd_help(client: Client, message) -> None:
     help_text = """📖 使用帮助
 
 🔍 监听管理：
-/watch 群ID|* 用户ID|* 关键词|*
-  添加监听规则（* 表示匹配所有）
+/watch 群 用户ID|* 关键词|*
+  添加监听规则（群可写群ID、t.me 链接、@用户名或 *；* 表示匹配所有；换行写多条可一次添加）
 /unwatch 序号
-  删除监听规则（序号从 /list 查看）
+  删除监听规则（序号从 /list 查看，可写 1-5,8 批量删除）
 /list
   查看所有规则
+/export
+  导出规则文件
+/import
+  导入规则文件（文件说明写 /import，或回复文件发送）
 
 📌 示例：
 /watch * 123456 * - 监控用户在所有群的所有消息
 /watch -100123 * 出售 - 监控某群所有人说"出售"
 /watch -100123 123456 三折 - 精确监控
+/watch https://t.me/dmithost * 出售 - 用群链接添加
+/watch -100123 * 三折 +年付 -求购 - 同时含"年付"、不含"求购"
+
+🔤 关键词写法（可组合，如 +cs:w:VPS）：
+  +词 必须同时出现   -词 出现则忽略
+  w:词 整词匹配（前后不能紧挨字母数字，中文不受影响）   cs:词 区分大小写
+  re:正则 正则匹配（不区分大小写，只查前 300 字；*、+、?、{m,n} 最多一处）
 
 🔔 通知设置：
 /notify add 目标ID - 添加通知目标
 /notify del 目标ID - 删除通知目标
 /notify list - 查看所有通知目标
 /notify clear - 清空所有通知目标
+/notify digest 秒数|off - 合并一段时间内的提醒
 
 👑 管理员（仅超管）：
 /admin add 用户ID - 添加管理员
 /admin del 用户ID - 删除管理员
 /admin list - 查看管理员列表
+/profile on|off - 开启/关闭规则开销统计
+/profile [数量] - 查看耗时最多的规则和各用户开销
+/profile dead - 查看从未命中的规则
+/profile export - 导出统计 JSON
+
+📊 运行状态：
+/stats - 查看消息量、延迟、发送失败等统计
 
 💡 提示：
 • 群ID 通常是负数，如 -1001234567
@@ -414,196 +780,562 @@ async def cmd_help(client: Client, message) -> None:
     await message.reply_text(help_text)
 
 
-async def process_message(message) -> None:
-    if not message.from_user or not message.chat:
-        return
+async def process_message(message, source: str = "live") -> bool:
+    """处理一条消息；返回它是否是第一次见到（未被去重）。
 
-    content = message.text or message.caption
-    if not content:
-        return
+    source 为 "live"（实时推送）或 "poll"（轮询补拉），只用于指标。
+    ingest 模式下消息只发布到队列，由 worker 进程匹配和发送通知。
+    """
+    metrics.MESSAGES_SEEN.inc(source)
+    if not message.from_user or not message.chat:
+        return False
 
     group_id = message.chat.id
     sender_id = message.from_user.id
     msg_id = message.id
 
-    if not _remember_message(group_id, msg_id):
-        return
+    snapshot = RULES
+    if not snapshot.may_match(group_id, sender_id):
+        return False
+
+    # 只有可能命中规则的消息才提取按钮、转发来源等文字
+    content = EXTRACTOR.document(message)
+    if not content:
+        return False
 
-    content_lower = content.lower()
+    if not _remember_message(group_id, msg_id):
+        metrics.DEDUP_RESULTS.inc("hit")
+        return False
+    metrics.DEDUP_RESULTS.inc("miss")
 
-    async with DATA_LOCK:
-        data_snapshot = json.loads(json.dumps(DATA_CACHE))
+    event = MessageEvent.from_message(message, content, source)
+    if BUS is not None:
+        # 多个采集进程/会话重复发布同一条消息时由队列去重
+        published = await BUS.publish(event)
+        metrics.BUS_PUBLISHED.inc("new" if published else "duplicate")
+        return True
+    await handle_event(event, snapshot)
+    return True
 
-    matched: Dict[str, Dict[str, Any]] = {}
-    for owner_id, bucket in data_snapshot.get("users", {}).items():
-        for rule in bucket.get("rules", []):
-            rule_group = rule.get("group_id")
-            rule_user = rule.get("user_id")
 
-            if rule_group is not None and rule_group != group_id:
-                continue
-            if rule_user is not None and rule_user != sender_id:
-                continue
+async def handle_event(event: MessageEvent, snapshot: RulesSnapshot | None = None) -> None:
+    """匹配一条已去重的消息，并把通知交给发送队列。"""
+    snapshot = snapshot or RULES
+    group_id = event.chat_id
+    sender_id = event.sender_id
+    msg_id = event.msg_id
+    content = event.text
 
-            keywords = rule.get("keywords", [])
-            if keywords == ["*"]:
-                hit = ["*"]
-            else:
-                hit = [kw for kw in keywords if _keyword_hit(content_lower, kw)]
-                if not hit:
-                    continue
-
-            entry = matched.setdefault(owner_id, {"keywords": set(), "notify_targets": bucket.get("notify_targets", [])})
-            entry["keywords"].update(hit)
-
-    if not matched or bot_client is None:
-        return
-
-    group_name = message.chat.title or message.chat.username or str(group_id)
-    username = message.from_user.username
-    display_name = (message.from_user.first_name or "")
-    if message.from_user.last_name:
-        display_name = f"{display_name} {message.from_user.last_name}".strip()
-    if username:
-        display_name = f"{display_name} (@{username})".strip()
-    if not display_name:
-        display_name = str(sender_id)
-
-    chat_username = message.chat.username
-    if chat_username:
-        group_link = f"https://t.me/{chat_username}"
-        msg_link = f"https://t.me/{chat_username}/{msg_id}"
-    else:
-        chat_id_str = str(group_id).replace("-100", "")
-        group_link = f"https://t.me/c/{chat_id_str}"
-        msg_link = f"https://t.me/c/{chat_id_str}/{msg_id}"
-
-    for owner_id, info in matched.items():
-        keywords_raw = "、".join(sorted(info["keywords"]))
-        keywords = "全部" if keywords_raw == "*" else keywords_raw
-        notify_targets = info.get("notify_targets", [])
-        if not notify_targets:
-            notify_targets = [int(owner_id)]  # 默认发给自己
-        
-        text = (
-            "🔔 消息提醒\n\n"
-            f"👥 群：{group_name}\n"
-            f"👤 用户：{display_name}\n"
-            f"🆔 ID：{sender_id}\n"
-            f"🔑 关键词：{keywords}\n"
-            f"💬 消息：{content}\n"
-            f"📍 直达：{msg_link}"
+    matched = await MATCHER.match(snapshot, group_id, sender_id, content)
+    if not matched or NOTIFIER is None:
+        return
+    for owner_id, hit_keywords in matched.items():
+        metrics.MATCHES.inc(owner_id)
+        logger.debug(
+            "规则命中",
+            extra={"chat_id": group_id, "msg_id": msg_id, "owner": owner_id, "rule": "、".join(sorted(hit_keywords))},
         )
-        
+
+    # 多个 owner 指向同一目标时合并成一条，关键词取并集；
+    # 只要有一个 owner 要求即时发送，就按最短的汇总窗口发送
+    deliveries: Dict[int, List[Any]] = {}
+    for owner_id, hit_keywords in matched.items():
+        notify_targets = snapshot.notify_targets(owner_id) or (int(owner_id),)  # 默认发给自己
+        digest_window = snapshot.digest_window(owner_id)
         for notify_target in notify_targets:
-            try:
-                await bot_client.send_message(notify_target, text)
-                print(f"[通知] 已发送通知到 {notify_target}")
-            except RPCError as exc:
-                print(f"[错误] 发送通知到 {notify_target} 失败: {exc}")
+            entry = deliveries.get(notify_target)
+            if entry is None:
+                deliveries[notify_target] = [set(hit_keywords), digest_window]
+            else:
+                entry[0].update(hit_keywords)
+                entry[1] = min(entry[1], digest_window)
+
+    group_name = PEERS.title(group_id, event.chat_title or event.chat_username)
+    head = (
+        "🔔 消息提醒\n\n"
+        f"👥 群：{group_name}\n"
+        f"👤 用户：{event.sender_name}\n"
+        f"🆔 ID：{sender_id}\n"
+    )
+    tail = f"💬 消息：{content}\n📍 直达：{PEERS.link(group_id, msg_id, event.chat_username)}"
+
+    rendered: Dict[str, str] = {}
+    for notify_target, (hit_keywords, digest_window) in deliveries.items():
+        keywords_raw = "、".join(sorted(hit_keywords))
+        text = rendered.get(keywords_raw)
+        if text is None:
+            keywords = "全部" if keywords_raw == "*" else keywords_raw
+            text = rendered[keywords_raw] = f"{head}🔑 关键词：{keywords}\n{tail}"
+        NOTIFIER.submit(notify_target, text, digest_window, event.date)
+
+
+async def _monitored_filter(_, __, message) -> bool:
+    chat = message.chat
+    if chat is None:
+        return False
+    sender = message.from_user
+    return RULES.may_match(chat.id, sender.id if sender else None)
+
+
+# 实时监听只接收有规则可能匹配的群/发送者，其余消息在分发阶段就被丢弃
+monitored = filters.create(_monitored_filter, "MonitoredFilter")
 
 
 async def on_user_message(client: Client, message) -> None:
-    await process_message(message)
+    if await process_message(message) and message.chat:
+        SCHEDULER.note_live(message.chat.id)
+
+
+async def on_polled_message(message) -> bool:
+    return await process_message(message, "poll")
+
+
+POLLER = Poller(
+    on_polled_message,
+    concurrency=config.POLL_CONCURRENCY,
+    timeout=config.POLL_CHAT_TIMEOUT,
+    max_pages=config.POLL_MAX_PAGES,
+)
+SCHEDULER = PollScheduler(
+    base_interval=POLL_INTERVAL_SECONDS,
+    min_interval=config.POLL_MIN_INTERVAL,
+    max_interval=config.POLL_MAX_INTERVAL,
+    live_interval=config.POLL_LIVE_INTERVAL,
+)
 
 
 async def poll_dialogs() -> None:
-    global user_client
-    if user_client is None:
+    if not len(SESSIONS):
         return
 
-    async with DATA_LOCK:
-        data_snapshot = json.loads(json.dumps(DATA_CACHE))
+    group_ids = RULES.group_ids
+    if SCHEDULER.sync(group_ids):
+        SESSIONS.watch(group_ids)
+    chat_ids = SCHEDULER.pop_due()
+    if not chat_ids:
+        return
 
-    chat_ids: Set[int] = set()
-    for bucket in data_snapshot.get("users", {}).values():
-        for rule in bucket.get("rules", []):
-            gid = rule.get("group_id")
-            if gid is not None:
-                chat_ids.add(gid)
+    logger.debug("轮询检查 %d/%d 个到期的群", len(chat_ids), len(SCHEDULER))
+
+    started = time.monotonic()
+    # 每个会话各自并发拉取自己负责的群；会话之间互不等待
+    assignment = SESSIONS.assign(chat_ids)
+    names = list(assignment)
+    reports = await asyncio.gather(*(POLLER.tick(SESSIONS[name].client, assignment[name]) for name in names))
+    duration = time.monotonic() - started
+    metrics.POLL_TICK_SECONDS.observe(duration)
+
+    polled = set()
+    for name, report in zip(names, reports):
+        SESSIONS.record(name, report)
+        polled.update(assignment[name])
+        for duration_chat in report.per_chat.values():
+            metrics.POLL_CHAT_SECONDS.observe(duration_chat)
+        failed = set(report.failed) | set(report.timed_out)
+        for chat_id in assignment[name]:
+            SCHEDULER.reschedule(
+                chat_id,
+                fetched=report.fetched.get(chat_id, 0),
+                fresh=report.fresh.get(chat_id, 0),
+                failed=chat_id in failed,
+            )
+        # 同一个群反复失败时由日志限流合并，不会每轮刷屏
+        for chat_id in report.failed:
+            logger.warning("群消息获取失败", extra={"chat_id": chat_id, "session": name})
+        for chat_id in report.timed_out:
+            logger.warning(
+                "群消息获取超时（>%g 秒）",
+                POLLER.timeout,
+                extra={"chat_id": chat_id, "session": name, "latency": report.per_chat.get(chat_id)},
+            )
+        for chat_id in report.truncated:
+            logger.warning(
+                "新消息超过 %d 页，本次先处理最早的部分，其余下次接着拉", POLLER.max_pages, extra={"chat_id": chat_id, "session": name}
+            )
+    # 没有可用会话时按失败退避，等会话恢复
+    for chat_id in chat_ids:
+        if chat_id not in polled:
+            SCHEDULER.reschedule(chat_id, fetched=0, fresh=0, failed=True)
+    if len(polled) < len(chat_ids):
+        logger.warning("没有可用的 userbot 会话，%d 个群本轮未轮询", len(chat_ids) - len(polled))
 
-    if not chat_ids:
+    await _save_cursors()
+
+    logger.info("轮询完成：%d 个群，%d 个会话", len(polled), len(names), extra={"latency": duration})
+
+
+async def _save_cursors() -> None:
+    if not POLLER.dirty or STORE is None:
         return
+    changed = {chat_id: POLLER.cursors[chat_id] for chat_id in POLLER.dirty}
+    POLLER.dirty.clear()
+    try:
+        await STORE.run(STORE.save_cursors, changed)
+    except sqlite3.Error as exc:
+        POLLER.dirty.update(changed)
+        logger.error("保存轮询游标失败: %s", exc)
 
-    print(f"[轮询] 检查 {len(chat_ids)} 个群...")
 
-    for chat_id in chat_ids:
+async def _save_dedup() -> None:
+    if STORE is None:
+        return
+    changed, evicted = DEDUP.snapshot()
+    if not changed and not evicted:
+        return
+    try:
+        await STORE.run(STORE.save_dedup, changed, evicted)
+    except sqlite3.Error as exc:
+        DEDUP.mark_dirty(changed)
+        logger.error("保存去重状态失败: %s", exc)
+
+
+async def _save_peers() -> None:
+    if STORE is None or not (PEERS.dirty or PEERS.dirty_hashes):
+        return
+    peers, hashes = PEERS.snapshot()
+    try:
+        await STORE.run(STORE.save_peers, peers, hashes)
+    except sqlite3.Error as exc:
+        logger.error("保存群信息缓存失败: %s", exc)
+
+
+async def _seed_peers(name: str, user: Client) -> None:
+    """把数据库里记录的 access hash 写回会话存储，用 session string 启动时不必重新解析每个群。"""
+    try:
+        rows = await STORE.run(STORE.load_peer_hashes, name)
+        if rows:
+            await user.storage.update_peers(
+                [(chat_id, access_hash, peer_type, username, None) for chat_id, access_hash, peer_type, username in rows]
+            )
+    except Exception as exc:
+        logger.warning("预填会话 %s 的群信息失败: %s", name, exc, extra={"session": name})
+
+
+async def _refresh_peers() -> None:
+    if not len(SESSIONS):
+        PEERS.load(Peer(*row) for row in await STORE.run(STORE.load_peers))
+        return
+    stale = PEERS.stale(RULES.group_ids, config.PEER_REFRESH_BATCH)
+    # 由负责轮询该群的会话获取，access hash 只对获取它的账号有效
+    for name, chat_ids in SESSIONS.assign(stale).items():
+        for chat_id in chat_ids:
+            try:
+                await PEERS.fetch(SESSIONS[name].client, chat_id, name)
+            except PeerError as exc:
+                logger.warning("刷新群信息失败: %s", exc, extra={"chat_id": chat_id, "session": name})
+    await _save_peers()
+
+
+async def peer_refresh_loop() -> None:
+    """定期刷新规则里各群的标题和用户名；没有 userbot 的进程只从数据库重新加载。"""
+    while True:
+        await asyncio.sleep(config.PEER_REFRESH_INTERVAL)
         try:
-            messages = [msg async for msg in user_client.get_chat_history(chat_id, limit=5)]
-            for msg in reversed(messages):
-                if msg:
-                    await process_message(msg)
-        except Exception:
-            print(f"[警告] 群 {chat_id} 获取失败")
+            await _refresh_peers()
+        except Exception as exc:
+            logger.exception("刷新群信息异常: %s", exc)
+
+
+async def _save_pending() -> bool:
+    """保存待发送通知的快照；返回快照是否为空。"""
+    if STORE is None or NOTIFIER is None:
+        return True
+    items = NOTIFIER.pending()
+    try:
+        await STORE.run(STORE.save_pending, config.INSTANCE_NAME, items)
+    except sqlite3.Error as exc:
+        logger.error("保存待发送通知失败: %s", exc)
+        return False
+    return not items
+
+
+async def notify_snapshot_loop() -> None:
+    empty = False
+    while True:
+        await asyncio.sleep(config.NOTIFY_SNAPSHOT_INTERVAL)
+        # 已经存过空快照、之后也一直没有通知时不必反复写库
+        if not empty or NOTIFIER.pending():
+            empty = await _save_pending()
+
+
+async def dedup_snapshot_loop() -> None:
+    while True:
+        await asyncio.sleep(config.DEDUP_SNAPSHOT_INTERVAL)
+        await _save_dedup()
 
-    print("[轮询] 检查完成")
+
+async def catch_up() -> None:
+    """启动补拉：把有游标的群从上次处理到的位置一直拉到最新，再进入正常轮询。
+
+    每个群最多翻 CATCHUP_MAX_PAGES 页，整体不超过 CATCHUP_BUDGET 秒，并发数与正常轮询相同；
+    到期还没轮到的群交给正常轮询继续追。
+    """
+    chat_ids = [chat_id for chat_id in RULES.group_ids if chat_id in POLLER.cursors]
+    if not chat_ids or config.CATCHUP_BUDGET <= 0:
+        return
+    started = time.monotonic()
+    deadline = started + config.CATCHUP_BUDGET
+    assignment = SESSIONS.assign(chat_ids)
+    reports = await asyncio.gather(
+        *(
+            POLLER.tick(SESSIONS[name].client, assigned, max_pages=config.CATCHUP_MAX_PAGES, deadline=deadline)
+            for name, assigned in assignment.items()
+        )
+    )
+    await _save_cursors()
+    fetched = sum(sum(report.fetched.values()) for report in reports)
+    fresh = sum(sum(report.fresh.values()) for report in reports)
+    unfinished = sum(len(report.timed_out) + len(report.skipped) + len(report.truncated) for report in reports)
+    logger.info(
+        "启动补拉完成：%d 个群，拉取 %d 条，新消息 %d 条，%d 个群未追完",
+        len(chat_ids),
+        fetched,
+        fresh,
+        unfinished,
+        extra={"latency": time.monotonic() - started},
+    )
 
 
 async def polling_loop() -> None:
+    try:
+        await catch_up()
+    except Exception as exc:
+        logger.exception("启动补拉异常: %s", exc)
+    # 补拉结束后才接收实时推送：否则一条实时消息就会把去重窗口推到最新，
+    # 补拉到的更早的消息落在窗口之外，被当成已处理而丢掉
+    for session in SESSIONS:
+        session.client.add_handler(MessageHandler(on_user_message, monitored & filters.incoming))
     while True:
         try:
             await poll_dialogs()
         except Exception as exc:
-            print(f"[错误] 轮询循环异常: {exc}")
-        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            logger.exception("轮询循环异常: %s", exc)
+        # 睡到下一个群到期；规则里新加的群最多等 POLL_MIN_INTERVAL 秒就会被发现
+        next_due = SCHEDULER.next_due()
+        delay = config.POLL_MIN_INTERVAL if next_due is None else next_due - time.monotonic()
+        await asyncio.sleep(min(max(delay, 0.5), config.POLL_MIN_INTERVAL))
 
 
-async def main() -> None:
-    if config.API_ID == 0 or not config.API_HASH:
-        raise SystemExit("缺少 TG_API_ID 或 TG_API_HASH 环境变量。")
-    if not config.BOT_TOKEN:
-        raise SystemExit("缺少 TG_BOT_TOKEN 环境变量。")
-    if not config.USER_SESSION_STRING:
-        raise SystemExit("缺少 TG_USER_SESSION_STRING 环境变量。")
-
-    global DATA_CACHE, ADMINS_CACHE, bot_client, user_client
-    DATA_CACHE = _load_data(config.RULES_PATH)
-    ADMINS_CACHE = _load_admins()
-
-    bot = Client(
-        name="bot",
-        api_id=config.API_ID,
-        api_hash=config.API_HASH,
-        bot_token=config.BOT_TOKEN,
-        workdir="./",
-    )
+async def consume_loop(consumer: str) -> None:
+    """worker：从队列认领一批消息，匹配并提交通知后再确认。
 
-    user = Client(
-        name="user",
-        api_id=config.API_ID,
-        api_hash=config.API_HASH,
-        session_string=config.USER_SESSION_STRING,
-        workdir="./",
-    )
+    进程在确认前退出时，这批消息超过 BUS_VISIBILITY 秒后会被其他 worker 重新认领。
+    """
+    while True:
+        # 发送跟不上时先不认领，让消息留在队列里，而不是在本进程被丢弃；队列不限长（0）时不用等
+        maxsize = NOTIFIER.queue.maxsize
+        if maxsize > 0 and NOTIFIER.queue.qsize() >= maxsize // 2:
+            await asyncio.sleep(0.5)
+            continue
+        try:
+            claimed = await BUS.claim(consumer, config.BUS_BATCH)
+        except Exception as exc:
+            logger.error("从消息队列认领失败: %s", exc)
+            await asyncio.sleep(1)
+            continue
+        if not claimed:
+            continue
+        snapshot = RULES
+        # 一起提交，匹配进程池可以把这一批合并成少数几次跨进程调用
+        results = await asyncio.gather(
+            *(handle_event(event, snapshot) for _, event in claimed), return_exceptions=True
+        )
+        for (_, event), result in zip(claimed, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    "处理消息失败: %s", result, exc_info=result, extra={"chat_id": event.chat_id, "msg_id": event.msg_id}
+                )
+        try:
+            await BUS.ack([entry_id for entry_id, _ in claimed])
+        except Exception as exc:
+            logger.error("确认消息失败: %s", exc)
+        metrics.BUS_CONSUMED.inc(amount=len(claimed))
 
-    bot.add_handler(MessageHandler(cmd_watch, filters.command("watch")))
-    bot.add_handler(MessageHandler(cmd_unwatch, filters.command("unwatch")))
-    bot.add_handler(MessageHandler(cmd_list, filters.command("list")))
-    bot.add_handler(MessageHandler(cmd_notify, filters.command("notify")))
-    bot.add_handler(MessageHandler(cmd_admin, filters.command("admin")))
-    bot.add_handler(MessageHandler(cmd_help, filters.command("help")))
 
-    user.add_handler(MessageHandler(on_user_message, filters.incoming))
+async def _reload_rules() -> None:
+    global DATA_CACHE, RULES, ADMINS_CACHE
+    async with DATA_LOCK:
+        DATA_CACHE = await STORE.run(STORE.load_data)
+        RULES = RulesSnapshot.build(DATA_CACHE)
+        ADMINS_CACHE = await STORE.run(STORE.load_admins)
 
-    bot_client = bot
-    user_client = user
 
-    await bot.start()
-    await user.start()
+async def rules_reload_loop() -> None:
+    """ingest/worker 模式下规则由处理命令的进程修改，其他进程发现数据库变化后重新加载。"""
+    revision = await STORE.run(STORE.rules_revision)
+    while True:
+        await asyncio.sleep(config.RULES_RELOAD_INTERVAL)
+        try:
+            current = await STORE.run(STORE.rules_revision)
+            if current == revision:
+                continue
+            revision = current
+            await _reload_rules()
+            logger.info("规则已被其他进程修改，重新加载 %d 条", len(RULES.index))
+        except sqlite3.Error as exc:
+            logger.error("重新加载规则失败: %s", exc)
 
-    print("Bot 和 Userbot 已启动。")
-    print(f"使用轮询模式监听消息（每{POLL_INTERVAL_SECONDS}秒检查一次）...")
 
-    polling_task = asyncio.create_task(polling_loop())
+async def main() -> None:
+    global DATA_CACHE, RULES, ADMINS_CACHE, NOTIFIER, STORE, BUS, bot_client
+    mode = config.RUN_MODE
+    if mode not in ("all", "ingest", "worker"):
+        raise SystemExit(f"RUN_MODE 只能是 all、ingest 或 worker，当前为 {mode!r}。")
+    ingest = mode in ("all", "ingest")
+    worker = mode in ("all", "worker")
+    # 多个 worker 时只有一个处理 bot 命令，其余进程从数据库重新加载规则
+    commands = mode == "all" or (worker and config.WORKER_COMMANDS)
+
+    if config.API_ID == 0 or not config.API_HASH:
+        raise SystemExit("缺少 TG_API_ID 或 TG_API_HASH 环境变量。")
+    if worker and not config.BOT_TOKEN:
+        raise SystemExit("缺少 TG_BOT_TOKEN 环境变量。")
+    if ingest and not config.USER_SESSION_STRINGS:
+        raise SystemExit("缺少 TG_USER_SESSION_STRING 或 TG_USER_SESSION_STRINGS 环境变量。")
+
+    STORE = Store(config.DB_PATH)
+    if await STORE.run(migrate_json, STORE, config.RULES_PATH, config.ADMINS_PATH, config.CURSORS_PATH):
+        logger.info("已将 %s 等旧 JSON 数据导入 %s", config.RULES_PATH, config.DB_PATH)
+    if NORMALIZER:
+        rewritten = await STORE.run(STORE.normalize_rules, NORMALIZER, NORMALIZER.signature)
+        if rewritten:
+            logger.info("已按新的文本规范化方式更新 %d 条规则的关键词", rewritten)
+    DATA_CACHE = await STORE.run(STORE.load_data)
+    RULES = RulesSnapshot.build(DATA_CACHE)
+    ADMINS_CACHE = await STORE.run(STORE.load_admins)
+    PEERS.load(Peer(*row) for row in await STORE.run(STORE.load_peers))
+    if ingest:
+        POLLER.cursors = await STORE.run(STORE.load_cursors)
+        DEDUP.restore(await STORE.run(STORE.load_dedup))
+    if mode != "all":
+        BUS = open_bus(config.BUS_URL, config.BUS_VISIBILITY, config.BUS_RETENTION)
+        await BUS.start()
+
+    bot = None
+    if worker:
+        bot = Client(
+            name="bot",
+            api_id=config.API_ID,
+            api_hash=config.API_HASH,
+            bot_token=config.BOT_TOKEN,
+            workdir="./",
+        )
+        if commands:
+            bot.add_handler(MessageHandler(cmd_watch, filters.command("watch")))
+            bot.add_handler(MessageHandler(cmd_unwatch, filters.command("unwatch")))
+            bot.add_handler(MessageHandler(cmd_import, filters.command("import")))
+            bot.add_handler(MessageHandler(cmd_export, filters.command("export")))
+            bot.add_handler(MessageHandler(cmd_list, filters.command("list")))
+            bot.add_handler(MessageHandler(cmd_notify, filters.command("notify")))
+            bot.add_handler(MessageHandler(cmd_admin, filters.command("admin")))
+            bot.add_handler(MessageHandler(cmd_stats, filters.command("stats")))
+            bot.add_handler(MessageHandler(cmd_profile, filters.command("profile")))
+            bot.add_handler(MessageHandler(cmd_help, filters.command("help")))
+        bot_client = bot
+        NOTIFIER = Notifier(
+            bot.send_message,
+            workers=config.NOTIFY_WORKERS,
+            queue_size=config.NOTIFY_QUEUE_SIZE,
+            target_rate=config.NOTIFY_TARGET_RATE,
+            global_rate=config.NOTIFY_GLOBAL_RATE,
+            max_retries=config.NOTIFY_MAX_RETRIES,
+        )
+
+    users = {}
+    if ingest:
+        users = {
+            session_name(session_string): Client(
+                name=session_name(session_string),
+                api_id=config.API_ID,
+                api_hash=config.API_HASH,
+                session_string=session_string,
+                workdir="./",
+            )
+            for session_string in config.USER_SESSION_STRINGS
+        }
+        # 每个会话都接收实时推送（在 polling_loop 补拉之后注册）；多个账号在同一个群里时由全局去重合并
+
+    if bot is not None:
+        await bot.start()
+    for name, user in users.items():
+        try:
+            await user.start()
+        except Exception as exc:
+            logger.error("会话 %s 启动失败: %s", name, exc, extra={"session": name})
+            SESSIONS.add(name, user, up=False)
+        else:
+            SESSIONS.add(name, user)
+            await _seed_peers(name, user)
+    if ingest and not SESSIONS.healthy:
+        if bot is not None:
+            await bot.stop()
+        raise SystemExit("所有 userbot 会话都启动失败。")
+
+    tasks = []
+    if ingest:
+        SESSIONS.watch(RULES.group_ids)
+        logger.info("%d/%d 个 Userbot 会话已启动。", SESSIONS.healthy, len(SESSIONS))
+        logger.info(
+            "使用轮询模式监听消息（每个群 %g~%g 秒自适应检查一次）...", config.POLL_MIN_INTERVAL, config.POLL_MAX_INTERVAL
+        )
+        tasks.append(asyncio.create_task(polling_loop()))
+        tasks.append(asyncio.create_task(dedup_snapshot_loop()))
+    if worker:
+        MATCHER.start()
+        restored = NOTIFIER.restore([Notification(*row) for row in await STORE.run(STORE.load_pending, config.INSTANCE_NAME)])
+        if restored:
+            logger.info("已恢复 %d 条上次未发送的通知", restored)
+        NOTIFIER.start()
+        tasks.append(asyncio.create_task(notify_snapshot_loop()))
+        logger.info("Bot 已启动%s。", "" if commands else "（不处理命令）")
+    if mode == "worker":
+        consumer = f"{socket.gethostname()}-{os.getpid()}"
+        tasks.append(asyncio.create_task(consume_loop(consumer)))
+        logger.info("从消息队列 %s 消费消息（%s）", config.BUS_URL, consumer)
+    elif mode == "ingest":
+        logger.info("消息发布到队列 %s", config.BUS_URL)
+    if not commands:
+        tasks.append(asyncio.create_task(rules_reload_loop()))
+    tasks.append(asyncio.create_task(peer_refresh_loop()))
+    metrics_server = None
+    if config.METRICS_PORT:
+        try:
+            metrics_server = await metrics.serve(config.METRICS_HOST, config.METRICS_PORT)
+            logger.info("指标地址：http://%s:%d/metrics", config.METRICS_HOST, config.METRICS_PORT)
+        except OSError as exc:
+            logger.warning("指标服务启动失败: %s", exc)
 
     await idle()
 
-    polling_task.cancel()
-    with suppress(asyncio.CancelledError):
-        await polling_task
-    await bot.stop()
-    await user.stop()
+    # 先停止认领和轮询，再把已交给发送队列的通知发完
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await MATCHER.close()
+    if NOTIFIER is not None:
+        await NOTIFIER.stop()
+        await _save_pending()
+    if ingest:
+        await _save_cursors()
+        await _save_dedup()
+    await _save_peers()
+    if bot is not None:
+        await bot.stop()
+    for user in users.values():
+        if user.is_connected:
+            await user.stop()
+    if BUS is not None:
+        await BUS.close()
+    STORE.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    log.setup(config.LOG_LEVEL, config.LOG_FORMAT, config.LOG_RATE_LIMIT)
+    try:
+        asyncio.run(main())
+    finally:
+        log.shutdown()
@@ -0,0 +1,251 @@
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from keywords import KeywordEngine, KeywordError, Query, compile_query
+
+
+class IndexedRule(NamedTuple):
+    owner_id: str
+    group_id: Optional[int]
+    user_id: Optional[int]
+    keywords: Tuple[str, ...]
+    # 交给 KeywordEngine 扫描的小写普通关键词
+    lowered: Tuple[str, ...]
+    # 使用了 +/- 或 re:/w:/cs: 写法时的编译结果，普通规则为 None
+    query: Optional[Query] = None
+
+
+class OwnerSettings(NamedTuple):
+    notify_targets: Tuple[int, ...]
+    digest_window: int
+
+
+IndexKey = Tuple[Optional[int], Optional[int]]
+
+
+def _make_rule(owner_id: str, rule: Dict[str, Any]) -> IndexedRule:
+    keywords = tuple(rule.get("keywords", []))
+    try:
+        query = compile_query(keywords)
+    except KeywordError:
+        # 添加时已校验过；旧数据里解析不了的关键词按普通关键词处理
+        query = None
+    return IndexedRule(
+        owner_id=str(owner_id),
+        group_id=rule.get("group_id"),
+        user_id=rule.get("user_id"),
+        keywords=keywords,
+        lowered=query.lowered if query is not None else tuple(kw.lower() for kw in keywords),
+        query=query,
+    )
+
+
+def _make_owner(bucket: Dict[str, Any]) -> OwnerSettings:
+    return OwnerSettings(
+        notify_targets=tuple(bucket.get("notify_targets", [])),
+        digest_window=int(bucket.get("notify_digest", 0) or 0),
+    )
+
+
+class RuleIndex:
+    """按 (group_id, user_id) 分桶的规则索引，None 作为通配桶。
+
+    一条消息最多只需查看 4 个桶：(群, 用户)、(群, *)、(*, 用户)、(*, *)。
+    索引不可变：增删规则返回新索引，只复制被修改的那个桶。
+    """
+
+    __slots__ = ("_buckets", "_size")
+
+    def __init__(self, buckets: Optional[Dict[IndexKey, Tuple[IndexedRule, ...]]] = None, size: int = 0) -> None:
+        self._buckets: Dict[IndexKey, Tuple[IndexedRule, ...]] = buckets or {}
+        self._size = size
+
+    @classmethod
+    def build(cls, data: Dict[str, Any]) -> "RuleIndex":
+        buckets: Dict[IndexKey, list] = {}
+        size = 0
+        for owner_id, bucket in data.get("users", {}).items():
+            for rule in bucket.get("rules", []):
+                item = _make_rule(owner_id, rule)
+                buckets.setdefault((item.group_id, item.user_id), []).append(item)
+                size += 1
+        return cls({key: tuple(items) for key, items in buckets.items()}, size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def keys(self) -> Iterator[IndexKey]:
+        return iter(self._buckets)
+
+    def rules(self) -> Iterator[IndexedRule]:
+        for bucket in self._buckets.values():
+            yield from bucket
+
+    def added_many(self, owner_id: str, rules: Iterable[Dict[str, Any]]) -> "RuleIndex":
+        """批量添加：字典只复制一次，每个受影响的桶只重建一次。"""
+        grouped: Dict[IndexKey, List[IndexedRule]] = {}
+        for rule in rules:
+            item = _make_rule(owner_id, rule)
+            grouped.setdefault((item.group_id, item.user_id), []).append(item)
+        if not grouped:
+            return self
+        buckets = dict(self._buckets)
+        for key, items in grouped.items():
+            buckets[key] = buckets.get(key, ()) + tuple(items)
+        return RuleIndex(buckets, self._size + sum(len(items) for items in grouped.values()))
+
+    def removed_many(self, owner_id: str, rules: Iterable[Dict[str, Any]]) -> "RuleIndex":
+        grouped: Dict[IndexKey, List[IndexedRule]] = {}
+        for rule in rules:
+            item = _make_rule(owner_id, rule)
+            grouped.setdefault((item.group_id, item.user_id), []).append(item)
+        buckets = dict(self._buckets)
+        size = self._size
+        for key, items in grouped.items():
+            remaining = list(buckets.get(key, ()))
+            for item in items:
+                if item in remaining:
+                    remaining.remove(item)
+                    size -= 1
+            if remaining:
+                buckets[key] = tuple(remaining)
+            else:
+                buckets.pop(key, None)
+        if size == self._size:
+            return self
+        return RuleIndex(buckets, size)
+
+    def candidates(self, group_id: int, sender_id: int) -> Iterator[IndexedRule]:
+        buckets = self._buckets
+        for key in ((group_id, sender_id), (group_id, None), (None, sender_id), (None, None)):
+            bucket = buckets.get(key)
+            if bucket:
+                yield from bucket
+
+
+class RulesSnapshot:
+    """某一版本规则的只读快照。
+
+    每次修改规则或通知目标都会生成新快照并整体替换，读取方直接拿引用即可，
+    既不用加锁也不用复制。关键词匹配器在该版本第一次匹配时构建。
+    """
+
+    __slots__ = ("version", "index", "owners", "_group_ids", "_sender_ids", "_match_all", "_engine")
+
+    def __init__(
+        self,
+        version: int,
+        index: RuleIndex,
+        owners: Dict[str, OwnerSettings],
+        engine: Optional[KeywordEngine] = None,
+    ) -> None:
+        self.version = version
+        self.index = index
+        self.owners = owners
+        self._group_ids: Optional[FrozenSet[int]] = None
+        self._sender_ids: FrozenSet[int] = frozenset()
+        self._match_all = False
+        self._engine = engine
+
+    @classmethod
+    def build(cls, data: Dict[str, Any], version: int = 0) -> "RulesSnapshot":
+        owners = {str(owner_id): _make_owner(bucket) for owner_id, bucket in data.get("users", {}).items()}
+        return cls(version, RuleIndex.build(data), owners)
+
+    def _build_interest(self) -> FrozenSet[int]:
+        keys = list(self.index.keys())
+        self._sender_ids = frozenset(uid for gid, uid in keys if gid is None and uid is not None)
+        self._match_all = (None, None) in keys
+        self._group_ids = frozenset(gid for gid, _ in keys if gid is not None)
+        return self._group_ids
+
+    @property
+    def group_ids(self) -> FrozenSet[int]:
+        return self._group_ids if self._group_ids is not None else self._build_interest()
+
+    def may_match(self, chat_id: int, sender_id: Optional[int]) -> bool:
+        """是否存在可能匹配该群/发送者的规则；不可能时消息可以直接丢弃。"""
+        group_ids = self.group_ids
+        return self._match_all or chat_id in group_ids or sender_id in self._sender_ids
+
+    @property
+    def engine(self) -> KeywordEngine:
+        if self._engine is None:
+            self._engine = KeywordEngine(kw for rule in self.index.rules() for kw in rule.lowered)
+        return self._engine
+
+    def with_rules_added(self, owner_id: str, rules: Iterable[Dict[str, Any]]) -> "RulesSnapshot":
+        return RulesSnapshot(self.version + 1, self.index.added_many(owner_id, rules), self.owners)
+
+    def with_rules_removed(self, owner_id: str, rules: Iterable[Dict[str, Any]]) -> "RulesSnapshot":
+        return RulesSnapshot(self.version + 1, self.index.removed_many(owner_id, rules), self.owners)
+
+    def with_owner(self, owner_id: str, bucket: Dict[str, Any]) -> "RulesSnapshot":
+        owners = dict(self.owners)
+        owners[str(owner_id)] = _make_owner(bucket)
+        return RulesSnapshot(self.version + 1, self.index, owners, self._engine)
+
+    def notify_targets(self, owner_id: str) -> Tuple[int, ...]:
+        settings = self.owners.get(owner_id)
+        return settings.notify_targets if settings else ()
+
+    def digest_window(self, owner_id: str) -> int:
+        settings = self.owners.get(owner_id)
+        return settings.digest_window if settings else 0
+
+    def match(
+        self, group_id: int, sender_id: int, content_lower: str, content: Optional[str] = None, profiler: Any = None
+    ) -> Dict[str, Set[str]]:
+        """返回 {owner_id: 命中的关键词集合}。
+
+        content 是原文，用于区分大小写的关键词和正则；不传时用 content_lower。
+        传入 profiler（profiler.RuleProfiler）时逐条规则计时并记录命中情况。
+        """
+        if profiler is not None:
+            return self._match_profiled(group_id, sender_id, content_lower, content, profiler)
+        matched: Dict[str, Set[str]] = {}
+        hits: Optional[Set[str]] = None
+        for rule in self.index.candidates(group_id, sender_id):
+            keywords = rule.keywords
+            if keywords == ("*",):
+                hit = ["*"]
+            else:
+                if hits is None:
+                    hits = self.engine.hits(content_lower)
+                if rule.query is None:
+                    hit = [kw for kw, lowered in zip(keywords, rule.lowered) if lowered in hits]
+                else:
+                    hit = rule.query.matches(content if content is not None else content_lower, hits)
+                if not hit:
+                    continue
+            matched.setdefault(rule.owner_id, set()).update(hit)
+        return matched
+
+    def _match_profiled(
+        self, group_id: int, sender_id: int, content_lower: str, content: Optional[str], profiler: Any
+    ) -> Dict[str, Set[str]]:
+        clock = time.perf_counter
+        matched: Dict[str, Set[str]] = {}
+        scan = 0.0
+        hits: Optional[Set[str]] = None
+        for rule in self.index.candidates(group_id, sender_id):
+            keywords = rule.keywords
+            if keywords == ("*",):
+                hit = ["*"]
+                profiler.record(rule, True, 0.0)
+            else:
+                if hits is None:
+                    started = clock()
+                    hits = self.engine.hits(content_lower)
+                    scan = clock() - started
+                started = clock()
+                if rule.query is None:
+                    hit = [kw for kw, lowered in zip(keywords, rule.lowered) if lowered in hits]
+                else:
+                    hit = rule.query.matches(content if content is not None else content_lower, hits)
+                profiler.record(rule, bool(hit), clock() - started)
+                if not hit:
+                    continue
+            matched.setdefault(rule.owner_id, set()).update(hit)
+        profiler.record_message(scan)
+        return matched
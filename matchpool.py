@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import metrics
+from matcher import RuleIndex, RulesSnapshot
+from normalize import Normalizer
+from profiler import RuleProfiler
+
+logger = logging.getLogger(__name__)
+
+Matched = Dict[str, Set[str]]
+Job = Tuple[int, int, str]
+
+# ---- 子进程内的状态 ----
+
+_NORMALIZER: Optional[Normalizer] = None
+_GENERATION = -1
+_SNAPSHOT: Optional[RulesSnapshot] = None
+
+
+def _init_worker(steps: Sequence[str]) -> None:
+    global _NORMALIZER
+    _NORMALIZER = Normalizer(steps)
+
+
+def _match_batch(generation: int, payload: Optional[bytes], jobs: List[Job]) -> Optional[List[Tuple[Matched, float]]]:
+    """在子进程里匹配一批消息；本进程还没有这一版规则且未附带规则时返回 None。"""
+    global _GENERATION, _SNAPSHOT
+    if payload is not None:
+        _SNAPSHOT = RulesSnapshot.build(pickle.loads(payload))
+        _GENERATION = generation
+    elif generation != _GENERATION:
+        return None
+    results = []
+    for group_id, sender_id, content in jobs:
+        started = time.perf_counter()
+        normalized = _NORMALIZER(content)
+        matched = _SNAPSHOT.match(group_id, sender_id, normalized.lower(), normalized)
+        results.append((matched, time.perf_counter() - started))
+    return results
+
+
+def _dump_rules(index: RuleIndex) -> bytes:
+    users: Dict[str, Any] = {}
+    for rule in index.rules():
+        users.setdefault(rule.owner_id, {"rules": []})["rules"].append(
+            {"group_id": rule.group_id, "user_id": rule.user_id, "keywords": list(rule.keywords)}
+        )
+    return pickle.dumps({"users": users}, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class MatchPool:
+    """关键词匹配执行器：规则多或消息长时交给子进程匹配，事件循环只做 I/O。
+
+    规则集每个版本只序列化一次，子进程第一次遇到新版本时才接收完整规则并
+    自行编译，之后每批只传消息。消息攒成最多 batch_size 条、最多等待
+    batch_delay 秒的小批次一起提交。规则数少于 min_rules 且消息短于
+    min_chars 时仍在事件循环里直接匹配，省掉跨进程往返；workers 为 0 时总是如此。
+    开启 profiler 期间也全部在事件循环里匹配，统计才能记在本进程。
+    """
+
+    def __init__(
+        self,
+        normalizer: Normalizer,
+        workers: int = 0,
+        min_rules: int = 5000,
+        min_chars: int = 2000,
+        batch_size: int = 64,
+        batch_delay: float = 0.002,
+        profiler: Optional[RuleProfiler] = None,
+    ) -> None:
+        self.normalizer = normalizer
+        self.workers = max(0, workers)
+        self.min_rules = min_rules
+        self.min_chars = min_chars
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self.profiler = profiler
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._index: Optional[RuleIndex] = None
+        self._generation = 0
+        self._payload: Optional[asyncio.Future] = None
+        self._pending: List[Tuple[Job, asyncio.Future]] = []
+        self._pending_snapshot: Optional[RulesSnapshot] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._broken = 0
+
+    def start(self) -> None:
+        if self.workers and self._pool is None:
+            # 父进程里已有存储、日志等线程，用 spawn 启动子进程，避免 fork 带走锁状态
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.normalizer.steps,),
+            )
+
+    async def close(self) -> None:
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def profiling(self) -> bool:
+        return self.profiler is not None and self.profiler.enabled
+
+    def _offload(self, snapshot: RulesSnapshot, content: str) -> bool:
+        if self._pool is None or self.profiling:
+            return False
+        return len(snapshot.index) >= self.min_rules or len(content) >= self.min_chars
+
+    def match_local(self, snapshot: RulesSnapshot, group_id: int, sender_id: int, content: str) -> Matched:
+        started = time.perf_counter()
+        normalized = self.normalizer(content)
+        profiler = self.profiler if self.profiling else None
+        matched = snapshot.match(group_id, sender_id, normalized.lower(), normalized, profiler)
+        metrics.MATCH_SECONDS.observe(time.perf_counter() - started)
+        return matched
+
+    async def match(self, snapshot: RulesSnapshot, group_id: int, sender_id: int, content: str) -> Matched:
+        """返回 {owner_id: 命中的关键词集合}。"""
+        if not self._offload(snapshot, content):
+            return self.match_local(snapshot, group_id, sender_id, content)
+        # 一个批次里的消息必须用同一版规则匹配
+        if self._pending and self._pending_snapshot is not snapshot:
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((group_id, sender_id, content), future))
+        self._pending_snapshot = snapshot
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, snapshot = self._pending, self._pending_snapshot
+        self._pending, self._pending_snapshot = [], None
+        task = asyncio.get_running_loop().create_task(self._run_batch(snapshot, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _rules_payload(self, snapshot: RulesSnapshot) -> Tuple[int, asyncio.Future]:
+        # 只改通知设置不会换索引，子进程里的规则仍然有效
+        if snapshot.index is not self._index:
+            self._index = snapshot.index
+            self._generation += 1
+            loop = asyncio.get_running_loop()
+            self._payload = loop.run_in_executor(None, _dump_rules, snapshot.index)
+        return self._generation, self._payload
+
+    async def _run_batch(self, snapshot: RulesSnapshot, batch: List[Tuple[Job, asyncio.Future]]) -> None:
+        jobs = [job for job, _ in batch]
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        results = None
+        try:
+            if pool is not None:
+                generation, payload = self._rules_payload(snapshot)
+                results = await loop.run_in_executor(pool, _match_batch, generation, None, jobs)
+                if results is None:
+                    results = await loop.run_in_executor(pool, _match_batch, generation, await payload, jobs)
+        except BrokenProcessPool as exc:
+            # 子进程被杀掉后整个进程池不可用；同一个池的其他批次不再重复处理
+            if pool is self._pool:
+                self._broken += 1
+                self._shutdown_pool()
+                if self._broken >= 3:
+                    logger.error("匹配进程池连续 %d 次损坏，改为全部在事件循环中匹配: %s", self._broken, exc)
+                else:
+                    logger.error("匹配进程池已损坏，正在重建: %s", exc)
+                    self.start()
+        except Exception as exc:
+            logger.error("匹配进程池出错，本批 %d 条改在事件循环中匹配: %s", len(jobs), exc)
+        for index, ((group_id, sender_id, content), future) in enumerate(batch):
+            if future.done():
+                continue
+            if results is None:
+                future.set_result(self.match_local(snapshot, group_id, sender_id, content))
+                continue
+            matched, elapsed = results[index]
+            metrics.MATCH_SECONDS.observe(elapsed)
+            future.set_result(matched)
+        if results is not None:
+            self._broken = 0
+            metrics.MATCH_POOL_MESSAGES.inc(amount=len(jobs))
+
+    def _shutdown_pool(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._index = None
@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# 默认的耗时分桶（秒），覆盖从微秒级的匹配到分钟级的端到端延迟
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Sequence[object]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: object, amount: float = 1) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: object) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        return dict(self._values)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+
+
+class Gauge(_Metric):
+    """数值由 set() 设置，或在每次导出时调用 fn 取值。"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        fn: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *labels: object) -> None:
+        self._values[self._key(labels)] = value
+
+    def value(self, *labels: object) -> float:
+        if self.fn is not None and not labels:
+            return self.fn()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        if self.fn is not None:
+            yield f"{self.name} {self.fn():g}"
+            return
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *labels: object) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, *labels: object) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def mean(self, *labels: object) -> float:
+        key = self._key(labels)
+        total = sum(self._counts.get(key, ()))
+        return self._sums.get(key, 0.0) / total if total else 0.0
+
+    def quantile(self, q: float, *labels: object) -> float:
+        """按分桶估算分位数（返回所在桶的上界）。"""
+        counts = self._counts.get(self._key(labels))
+        if not counts:
+            return 0.0
+        target = q * sum(counts)
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def samples(self) -> Iterable[str]:
+        for key in sorted(self._counts):
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self._counts[key]):
+                running += count
+                le = 'le="+Inf"' if bound == float("inf") else 'le="%g"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]:g}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {running}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, fn))  # type: ignore[return-value]
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+
+MESSAGES_SEEN = counter("tgmon_messages_seen_total", "进入匹配流程的消息数", ["source"])
+DEDUP_RESULTS = counter("tgmon_dedup_total", "去重检查结果（hit 表示重复）", ["result"])
+MATCH_SECONDS = histogram("tgmon_match_seconds", "单条消息规则匹配耗时")
+MATCH_POOL_MESSAGES = counter("tgmon_match_pool_messages_total", "交给匹配进程池的消息数")
+MATCHES = counter("tgmon_matches_total", "按规则所有者统计的命中次数", ["owner"])
+NOTIFY_QUEUE_DEPTH = gauge("tgmon_notify_queue_depth", "待发送通知队列长度")
+NOTIFY_SEND_SECONDS = histogram("tgmon_notify_send_seconds", "单次 send_message 耗时")
+NOTIFY_SENT = counter("tgmon_notify_sent_total", "成功发送的通知数")
+NOTIFY_FAILURES = counter("tgmon_notify_failures_total", "通知发送失败次数", ["reason"])
+NOTIFY_FLOOD_WAITS = counter("tgmon_notify_flood_waits_total", "发送通知触发 FloodWait 的次数")
+POLL_TICK_SECONDS = histogram("tgmon_poll_tick_seconds", "一轮轮询的总耗时")
+POLL_CHAT_SECONDS = histogram("tgmon_poll_chat_seconds", "单个群一次轮询（拉取并处理）的耗时")
+SESSION_UP = gauge("tgmon_session_up", "userbot 会话是否参与轮询分配", ["session"])
+SESSION_CHATS = gauge("tgmon_session_chats", "每个会话负责轮询的群数", ["session"])
+SESSION_POLLS = counter("tgmon_session_polls_total", "每个会话的单群轮询次数", ["session", "result"])
+END_TO_END_SECONDS = histogram("tgmon_end_to_end_seconds", "消息发出（Telegram 时间）到通知发送成功的延迟")
+BUS_PUBLISHED = counter("tgmon_bus_published_total", "采集进程发布到消息队列的消息数（duplicate 表示已被其他进程发布）", ["result"])
+BUS_CONSUMED = counter("tgmon_bus_consumed_total", "worker 从消息队列处理完成的消息数")
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    """在 host:port 上提供 Prometheus 文本格式的 /metrics。"""
+    return await asyncio.start_server(_handle_http, host, port)
@@ -0,0 +1,139 @@
+import unicodedata
+from typing import Dict, Iterable, Optional, Tuple
+
+# 可选的规范化步骤
+STEPS = ("width", "simplified", "invisible", "emoji")
+
+# 常用繁体字 → 简体字（逐字对应；每组两个字，前繁后简）
+_TRADITIONAL = """
+萬万 與与 專专 業业 東东 絲丝 兩两 嚴严 喪丧 個个 豐丰 臨临 為为 麗丽 舉举 麼么 義义 烏乌 樂乐 喬乔
+習习 鄉乡 書书 買买 亂乱 爭争 於于 虧亏 雲云 亞亚 產产 畝亩 親亲 億亿 僅仅 從从 侖仑 倉仓 儀仪 們们
+價价 眾众 優优 會会 傘伞 偉伟 傳传 傷伤 倫伦 偽伪 體体 餘余 傭佣 俠侠 侶侣 偵侦 側侧 僑侨 債债 傾倾
+償偿 儲储 兒儿 兌兑 黨党 蘭兰 關关 興兴 養养 獸兽 內内 岡冈 冊册 寫写 軍军 農农 馮冯 衝冲 決决 況况
+凍冻 淨净 涼凉 減减 湊凑 幾几 鳳凤 憑凭 凱凯 擊击 劃划 劉刘 則则 剛刚 創创 刪删 別别 劑剂 劍剑 劇剧
+勸劝 辦办 務务 動动 勵励 勁劲 勞劳 勢势 勻匀 匯汇 區区 醫医 華华 協协 單单 賣卖 盧卢 衛卫 卻却 廠厂
+廳厅 曆历 歷历 厲厉 壓压 厭厌 廁厕 廂厢 廈厦 廚厨 縣县 參参 雙双 發发 髮发 變变 敘叙 疊叠 號号 嘆叹
+嚇吓 後后 嗎吗 啟启 員员 嗚呜 響响 問问 啞哑 喚唤 嘯啸 囑嘱 團团 園园 圍围 圖图 國国 圓圆 聖圣 場场
+壞坏 塊块 堅坚 壇坛 墳坟 墜坠 壘垒 執执 報报 塗涂 堯尧 墊垫 墮堕 聲声 壺壶 處处 備备 復复 複复 夠够
+頭头 奪夺 奮奋 獎奖 婦妇 媽妈 嬌娇 孫孙 學学 寧宁 寶宝 實实 寵宠 審审 憲宪 宮宫 寬宽 賓宾 對对 尋寻
+導导 將将 爾尔 塵尘 嘗尝 層层 屬属 歲岁 島岛 嶺岭 峽峡 帥帅 師师 帳帐 帶带 幫帮 廣广 莊庄 慶庆 廬庐
+應应 廢废 開开 異异 棄弃 張张 彌弥 彎弯 彈弹 強强 歸归 當当 錄录 徹彻 徑径 憶忆 懷怀 態态 戀恋 惡恶
+惱恼 悅悦 驚惊 慘惨 慣惯 願愿 懶懒 憂忧 戲戏 戰战 戶户 撲扑 擴扩 掃扫 揚扬 擾扰 撫抚 搶抢 護护 擔担
+擬拟 揀拣 擁拥 攔拦 撥拨 擇择 掛挂 撈捞 損损 撿捡 換换 據据 擋挡 擠挤 攪搅 擺摆 攜携 搖摇 敵敌 數数
+齋斋 斷断 無无 舊旧 時时 曠旷 晝昼 顯显 晉晋 曬晒 曉晓 暫暂 術术 機机 殺杀 雜杂 權权 條条 來来 楊杨
+極极 構构 槍枪 櫃柜 標标 棧栈 欄栏 樹树 樣样 檔档 橋桥 樁桩 夢梦 檢检 棟栋 歡欢 歐欧 殘残 毆殴 氣气
+漢汉 湯汤 溝沟 沒没 滅灭 淪沦 滄沧 溫温 濕湿 濟济 滿满 漁渔 漲涨 澤泽 潔洁 灑洒 濃浓 濤涛 澆浇 濁浊
+測测 渾浑 瀏浏 濱滨 潤润 澀涩 淺浅 漿浆 灣湾 燈灯 災灾 爐炉 點点 煉炼 爛烂 熱热 燒烧 營营 愛爱 爺爷
+牆墙 牽牵 犧牺 狀状 猶犹 獄狱 獨独 狹狭 獅狮 獵猎 獻献 環环 現现 瑪玛 畫画 暢畅 療疗 瘋疯 癢痒 盤盘
+監监 蓋盖 盜盗 瞞瞒 礦矿 碼码 磚砖 確确 禮礼 禍祸 離离 種种 積积 稱称 穩稳 窮穷 竊窃 競竞 筆笔 節节
+範范 築筑 簡简 類类 糧粮 緊紧 紅红 約约 級级 紀纪 純纯 紙纸 納纳 紛纷 線线 練练 組组 細细 終终 經经
+結结 給给 絕绝 統统 絡络 維维 綜综 綠绿 網网 編编 緣缘 總总 織织 繩绳 繼继 續续 績绩 纏缠 罰罚 羅罗
+職职 聯联 聽听 聰聪 肅肃 脅胁 腦脑 膽胆 臉脸 膠胶 艦舰 艙舱 藝艺 蘇苏 蘋苹 莖茎 薦荐 藥药 蕭萧 葉叶
+蓮莲 獲获 虛虚 蟲虫 蝦虾 補补 裝装 製制 見见 規规 覺觉 覽览 觀观 視视 觸触 計计 訂订 認认 討讨 讓让
+訓训 議议 記记 講讲 許许 論论 設设 訪访 證证 評评 識识 詞词 試试 詩诗 話话 誠诚 說说 請请 諸诸 讀读
+調调 談谈 課课 誰谁 謝谢 謠谣 貝贝 負负 貢贡 財财 責责 賢贤 敗败 貨货 質质 販贩 貪贪 貧贫 購购 貯贮
+貫贯 費费 貼贴 貴贵 貿贸 賀贺 資资 賊贼 賬账 賭赌 賴赖 賺赚 賠赔 贈赠 贊赞 趕赶 趙赵 躍跃 蹤踪 車车
+軌轨 軟软 轉转 輪轮 較较 載载 輕轻 輔辅 輸输 辭辞 邊边 遼辽 達达 遷迁 過过 運运 還还 這这 進进 遠远
+違违 連连 遲迟 適适 選选 遺遗 郵邮 鄧邓 鄭郑 醜丑 釋释 鑒鉴 針针 釣钓 鈔钞 鈕钮 鈴铃 鉛铅 銀银 銅铜
+鋁铝 銷销 鋒锋 鋪铺 鏈链 鋼钢 錢钱 錯错 錶表 鍋锅 鍵键 鎖锁 鎮镇 鏡镜 鐘钟 鐵铁 鑰钥 長长 門门 閃闪
+閉闭 閒闲 間间 閱阅 闊阔 闆板 閣阁 隊队 陽阳 陰阴 陣阵 階阶 際际 陸陆 隨随 險险 隱隐 難难 雞鸡 電电
+霧雾 靜静 靈灵 韓韩 頁页 頂顶 項项 順顺 須须 預预 領领 頻频 顆颗 題题 額额 顏颜 顧顾 風风 飛飞 飯饭
+飲饮 飽饱 飾饰 餅饼 館馆 饋馈 馬马 駐驻 駕驾 驗验 騎骑 騙骗 驅驱 鬆松 鬥斗 鬧闹 魚鱼 鮮鲜 鳥鸟 鴨鸭
+鹽盐 麥麦 黃黄 齊齐 齒齿 龍龙 龜龟 檯台 臺台 颱台 週周 裡里 係系 繫系 麵面 迴回 託托 噸吨 隻只 準准
+幹干 鍊链 頓顿 碩硕 紹绍 腳脚 蠟蜡 鎊镑 匯汇 訊讯 謀谋 贏赢 額额 館馆 儘尽 盡尽 濾滤 擁拥 獲获 續续
+"""
+
+# 零宽字符、方向控制符、变体选择符等不可见字符
+_INVISIBLE_RANGES = (
+    (0x00AD, 0x00AD), (0x034F, 0x034F), (0x061C, 0x061C), (0x115F, 0x1160), (0x17B4, 0x17B5),
+    (0x180E, 0x180E), (0x200B, 0x200F), (0x202A, 0x202E), (0x2060, 0x206F), (0x3164, 0x3164),
+    (0xFE00, 0xFE0F), (0xFEFF, 0xFEFF), (0xFFA0, 0xFFA0), (0xE0000, 0xE007F), (0xE0100, 0xE01EF),
+)
+
+# 常被用来装饰或隔开关键词的表情、符号
+_EMOJI_RANGES = (
+    (0x2190, 0x21FF), (0x2300, 0x23FF), (0x25A0, 0x25FF), (0x2600, 0x27BF), (0x2900, 0x297F),
+    (0x2B00, 0x2BFF), (0x3030, 0x3030), (0x303D, 0x303D), (0x3297, 0x3297), (0x3299, 0x3299),
+    (0x1F000, 0x1FAFF),
+)
+
+# 做兼容字符映射（全角、圈字、数学粗体字母等）的码位范围
+_WIDTH_RANGES = ((0x00A0, 0xD7FF), (0xF900, 0xFFEF), (0x1D400, 0x1D7FF), (0x1F100, 0x1F1FF))
+
+
+def _codepoints(ranges: Iterable[Tuple[int, int]]) -> Iterable[int]:
+    for start, end in ranges:
+        yield from range(start, end + 1)
+
+
+def _traditional_table() -> Dict[int, str]:
+    table: Dict[int, str] = {}
+    for pair in _TRADITIONAL.split():
+        traditional, simplified = pair
+        table[ord(traditional)] = simplified
+    return table
+
+
+def _width_table() -> Dict[int, str]:
+    """逐字的 NFKC 兼容映射：全角字母数字、圈字 ①Ⓐ、𝐀 这类数学字母等都还原成普通字符。"""
+    table: Dict[int, str] = {}
+    for cp in _codepoints(_WIDTH_RANGES):
+        ch = chr(cp)
+        mapped = unicodedata.normalize("NFKC", ch)
+        # 带空格的附加符号（如 ¨ → " ̈"）不映射，免得在文字中间插入空格
+        if mapped == ch or (len(mapped) > 1 and mapped[0] == " "):
+            continue
+        table[cp] = mapped
+    # 带底色的圈字/方块字母和区域指示符没有兼容分解，手动映射到字母
+    for start in (0x1F150, 0x1F170, 0x1F1E6):
+        for offset in range(26):
+            table[start + offset] = chr(ord("A") + offset)
+    return table
+
+
+class Normalizer:
+    """匹配前的文本规范化；所有步骤在构造时合并成一张 str.translate 转换表。
+
+    - width：全角/半角、圈字、数学字母等兼容字符 → 普通字符
+    - simplified：常用繁体字 → 简体字
+    - invisible：删除零宽空格等不可见字符
+    - emoji：删除表情和装饰符号
+    消息和关键词经过同一个 Normalizer，"三​折"、"３折"、"三🔥折" 都能命中 "三折"。
+    """
+
+    __slots__ = ("steps", "_table")
+
+    def __init__(self, steps: Iterable[str] = STEPS) -> None:
+        self.steps = tuple(step for step in STEPS if step in set(steps))
+        unknown = set(steps) - set(STEPS)
+        if unknown:
+            raise ValueError(f"未知的规范化步骤：{', '.join(sorted(unknown))}")
+
+        table: Dict[int, Optional[str]] = {}
+        if "emoji" in self.steps:
+            table.update(dict.fromkeys(_codepoints(_EMOJI_RANGES)))
+        if "width" in self.steps:
+            table.update(_width_table())
+        if "simplified" in self.steps:
+            simplified = _traditional_table()
+            for cp, mapped in list(table.items()):
+                if mapped:
+                    table[cp] = mapped.translate(simplified)
+            table.update(simplified)
+        if "invisible" in self.steps:
+            table.update(dict.fromkeys(_codepoints(_INVISIBLE_RANGES)))
+        self._table = table
+
+    def __bool__(self) -> bool:
+        return bool(self._table)
+
+    @property
+    def signature(self) -> str:
+        """规范化方式的标识；变了就需要重新规范化已保存的关键词。"""
+        return ",".join(self.steps)
+
+    def __call__(self, text: str) -> str:
+        # 转换表不改动 ASCII 字符，纯 ASCII 文本可以直接返回
+        if not self._table or text.isascii():
+            return text
+        return text.translate(self._table)
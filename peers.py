@@ -0,0 +1,177 @@
+import logging
+import re
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from pyrogram.errors import FloodWait, RPCError
+
+logger = logging.getLogger(__name__)
+
+LINK = re.compile(r"^(?:https?://)?(?:www\.)?(?:t|telegram)\.me/(?P<path>[^?#]*)", re.IGNORECASE)
+USERNAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]{3,31}$")
+
+# Pyrogram 会话存储里使用的 peer 类型名
+_PEER_TYPES = {"PRIVATE": "user", "BOT": "bot", "GROUP": "group", "SUPERGROUP": "supergroup", "CHANNEL": "channel"}
+
+
+class PeerError(ValueError):
+    pass
+
+
+class Peer(NamedTuple):
+    chat_id: int
+    username: Optional[str]
+    title: Optional[str]
+    peer_type: str
+    updated: float
+
+
+def parse_ref(text: str) -> Union[int, str]:
+    """群ID、t.me 链接或 @用户名 → 群ID（不需要请求）或小写用户名（需要解析）。"""
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    found = LINK.match(text)
+    if found:
+        parts = [part for part in found.group("path").split("/") if part]
+        if len(parts) >= 2 and parts[0] == "c" and parts[1].isdigit():
+            # 私有群的消息链接 t.me/c/<内部ID>/<消息ID>
+            return int("-100" + parts[1])
+        if parts and (parts[0].startswith("+") or parts[0] == "joinchat"):
+            raise PeerError("邀请链接无法解析，请先让 userbot 加入该群，再用群ID 添加")
+        if parts and parts[0] == "s":
+            parts = parts[1:]
+        text = parts[0] if parts else ""
+    username = text[1:] if text.startswith("@") else text
+    if not USERNAME.match(username):
+        raise PeerError(f"无法识别的群：{text or '（空）'}，应为群ID、t.me 链接、@用户名或 *")
+    return username.lower()
+
+
+class PeerCache:
+    """群的持久化缓存：用户名 → 群ID、标题、类型，以及各会话的 access hash。
+
+    解析结果在 ttl 秒内直接复用，不会每次命令或轮询都请求 Telegram；解析失败的
+    用户名在 failure_ttl 秒内也不再重试。通知里的群名和消息链接前缀都从这里取，
+    并由后台任务定期刷新。修改记在 dirty 里，由调用方批量写入数据库。
+    """
+
+    def __init__(self, ttl: float = 86400.0, failure_ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._by_id: Dict[int, Peer] = {}
+        self._by_username: Dict[str, int] = {}
+        self._failures: Dict[str, Tuple[float, str]] = {}
+        self._links: Dict[int, str] = {}
+        self.dirty: Dict[int, Peer] = {}
+        self.dirty_hashes: Dict[Tuple[str, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self, peers: Iterable[Peer]) -> None:
+        self._by_id.clear()
+        self._by_username.clear()
+        self._links.clear()
+        for peer in peers:
+            self._put(peer)
+
+    def _put(self, peer: Peer) -> None:
+        old = self._by_id.get(peer.chat_id)
+        if old is not None and old.username:
+            self._by_username.pop(old.username.lower(), None)
+        self._by_id[peer.chat_id] = peer
+        if peer.username:
+            self._by_username[peer.username.lower()] = peer.chat_id
+        self._links.pop(peer.chat_id, None)
+
+    def get(self, chat_id: int) -> Optional[Peer]:
+        return self._by_id.get(chat_id)
+
+    def title(self, chat_id: int, fallback: Optional[str] = None) -> str:
+        peer = self._by_id.get(chat_id)
+        if peer is not None and (peer.title or peer.username):
+            return peer.title or peer.username
+        return fallback or str(chat_id)
+
+    def link(self, chat_id: int, msg_id: int, username: Optional[str] = None) -> str:
+        """消息直达链接；每个群的前缀只拼一次。"""
+        prefix = self._links.get(chat_id)
+        if prefix is None:
+            peer = self._by_id.get(chat_id)
+            username = (peer.username if peer is not None else None) or username
+            if username:
+                prefix = f"https://t.me/{username}/"
+            else:
+                prefix = f"https://t.me/c/{str(chat_id).replace('-100', '')}/"
+            # 只有缓存里有的群才记住前缀，缓存更新时一起作废
+            if peer is not None:
+                self._links[chat_id] = prefix
+        return f"{prefix}{msg_id}"
+
+    def stale(self, chat_ids: Iterable[int], limit: int, now: Optional[float] = None) -> List[int]:
+        """需要（重新）获取的群：缓存里没有，或超过 ttl 未刷新；最旧的优先。"""
+        now = time.time() if now is None else now
+        ages = []
+        for chat_id in chat_ids:
+            peer = self._by_id.get(chat_id)
+            updated = peer.updated if peer is not None else 0.0
+            if now - updated >= self.ttl:
+                ages.append((updated, chat_id))
+        ages.sort()
+        return [chat_id for _, chat_id in ages[:limit]]
+
+    async def fetch(self, client: Any, ref: Union[int, str], session: Optional[str] = None) -> Peer:
+        """向 Telegram 获取群信息并写入缓存；session 不为空时记录该会话的 access hash。"""
+        try:
+            chat = await client.get_chat(ref)
+            raw_peer = await client.resolve_peer(chat.id) if session else None
+        except FloodWait as exc:
+            raise PeerError(f"请求过于频繁，请 {exc.value} 秒后再试") from exc
+        except (RPCError, KeyError, ValueError) as exc:
+            raise PeerError(f"无法获取群 {ref}：{str(exc).strip()}") from exc
+        peer = Peer(
+            chat_id=chat.id,
+            username=chat.username,
+            title=chat.title or chat.first_name,
+            peer_type=_PEER_TYPES.get(chat.type.name, "") if chat.type else "",
+            updated=time.time(),
+        )
+        self._put(peer)
+        self.dirty[peer.chat_id] = peer
+        access_hash = getattr(raw_peer, "access_hash", None)
+        if session and access_hash:
+            self.dirty_hashes[(session, peer.chat_id)] = access_hash
+        return peer
+
+    async def resolve(self, client: Any, username: str, session: Optional[str] = None) -> Peer:
+        """用户名 → 群；缓存未过期时不发请求。"""
+        key = username.lower()
+        now = time.time()
+        chat_id = self._by_username.get(key)
+        if chat_id is not None and now - self._by_id[chat_id].updated < self.ttl:
+            return self._by_id[chat_id]
+        failure = self._failures.get(key)
+        if failure is not None and now - failure[0] < self.failure_ttl:
+            raise PeerError(failure[1])
+        try:
+            peer = await self.fetch(client, username, session)
+        except PeerError as exc:
+            # 过期的缓存仍然可用，只是暂时刷新不了
+            if chat_id is not None:
+                logger.warning("刷新 @%s 失败，继续使用缓存: %s", username, exc)
+                return self._by_id[chat_id]
+            self._failures[key] = (now, str(exc))
+            raise
+        self._failures.pop(key, None)
+        return peer
+
+    def snapshot(self) -> Tuple[List[Peer], List[Tuple[str, int, int]]]:
+        """取出并清空待保存的修改。"""
+        peers = list(self.dirty.values())
+        hashes = [(session, chat_id, access_hash) for (session, chat_id), access_hash in self.dirty_hashes.items()]
+        self.dirty.clear()
+        self.dirty_hashes.clear()
+        return peers, hashes
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+class TickReport(NamedTuple):
+    duration: float
+    chats: int
+    failed: List[int]
+    timed_out: List[int]
+    truncated: List[int]
+    per_chat: Dict[int, float]
+    fetched: Dict[int, int]
+    fresh: Dict[int, int]
+    # 超过 deadline 还没轮到、本次未处理的群
+    skipped: List[int] = []
+
+
+class ChatPoll(NamedTuple):
+    fetched: int
+    fresh: int
+    truncated: bool
+
+
+class Poller:
+    """并发、增量地轮询多个群的新消息。
+
+    每个群记录已处理到的最大 message.id（游标），只拉取比游标新的消息，
+    新消息多时从游标开始往新的方向翻页，因此突发的大量消息不会丢，安静的群也不会
+    重复处理同样几条。一次超过 max_pages 页时先处理最早的一段，其余下次接着拉。
+    没有游标的群只看最新 initial_limit 条。
+
+    同时进行的请求数受 concurrency 限制；每个群的拉取有独立超时，
+    某个群卡住或报错只影响它自己。client 只需提供 Pyrogram 的
+    get_chat_history 接口，测试时可以换成模拟延迟的假客户端。
+    handler 返回真值表示这条消息此前没被处理过（未被去重）。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Optional[bool]]],
+        concurrency: int = 8,
+        timeout: float = 15.0,
+        initial_limit: int = 5,
+        page_size: int = 100,
+        max_pages: int = 10,
+        cursors: Optional[Dict[int, int]] = None,
+    ) -> None:
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.initial_limit = initial_limit
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.cursors: Dict[int, int] = dict(cursors or {})
+        # 游标有变化、尚未持久化的群
+        self.dirty: Set[int] = set()
+
+    async def _page(self, client: Any, chat_id: int, limit: int, offset_id: int, offset: int = 0) -> List[Any]:
+        return [
+            msg
+            async for msg in client.get_chat_history(chat_id, limit=limit, offset=offset, offset_id=offset_id)
+            if msg
+        ]
+
+    async def _fetch(self, client: Any, chat_id: int, max_pages: int) -> Tuple[List[Any], bool]:
+        """返回 (比游标新的消息, 是否因页数上限而未追上)。
+
+        未追上时只返回紧接游标之后、连续的那一段，游标推进到这段末尾，
+        下次轮询从这里接着拉，中间的消息不会被跳过。
+        """
+        cursor = self.cursors.get(chat_id)
+        if cursor is None:
+            return await self._page(client, chat_id, self.initial_limit, 0), False
+
+        # 第一页只取最新几条：安静的群一次请求就能确认没有新消息
+        page = await self._page(client, chat_id, self.initial_limit, 0)
+        newer = [msg for msg in page if msg.id > cursor]
+        if len(newer) < len(page) or len(page) < self.initial_limit:
+            return newer, False
+
+        # 新消息比第一页多：从游标往新的方向翻页（offset 取负数），直到接上第一页
+        newest = page[0].id
+        collected: Dict[int, Any] = {}
+        offset_id = cursor
+        for _ in range(max(1, max_pages - 1)):
+            forward = await self._page(client, chat_id, self.page_size, offset_id, -self.page_size)
+            for msg in forward:
+                if msg.id > cursor:
+                    collected[msg.id] = msg
+            top = max((msg.id for msg in forward), default=offset_id)
+            if top >= newest or top <= offset_id:
+                for msg in newer:
+                    collected.setdefault(msg.id, msg)
+                return list(collected.values()), False
+            offset_id = top
+        return list(collected.values()), True
+
+    async def poll_chat(
+        self, client: Any, chat_id: int, max_pages: Optional[int] = None, timeout: Optional[float] = None
+    ) -> ChatPoll:
+        messages, truncated = await asyncio.wait_for(
+            self._fetch(client, chat_id, max_pages or self.max_pages), timeout or self.timeout
+        )
+        messages.sort(key=lambda msg: msg.id)
+        fresh = 0
+        for msg in messages:
+            try:
+                if await self.handler(msg):
+                    fresh += 1
+            finally:
+                if msg.id > self.cursors.get(chat_id, 0):
+                    self.cursors[chat_id] = msg.id
+                    self.dirty.add(chat_id)
+        return ChatPoll(len(messages), fresh, truncated)
+
+    async def tick(
+        self, client: Any, chat_ids: Iterable[int], max_pages: Optional[int] = None, deadline: Optional[float] = None
+    ) -> TickReport:
+        """轮询一批群。max_pages 覆盖默认的翻页上限；给出 deadline（time.monotonic()）时，
+        每个群的拉取以剩余时间为超时，到期后还没开始的群直接跳过。"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        per_chat: Dict[int, float] = {}
+        failed: List[int] = []
+        timed_out: List[int] = []
+        truncated: List[int] = []
+        fetched: Dict[int, int] = {}
+        fresh: Dict[int, int] = {}
+        skipped: List[int] = []
+
+        async def run(chat_id: int) -> None:
+            async with semaphore:
+                started = time.monotonic()
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - started
+                    if timeout <= 0:
+                        skipped.append(chat_id)
+                        return
+                try:
+                    result = await self.poll_chat(client, chat_id, max_pages, timeout)
+                    fetched[chat_id] = result.fetched
+                    fresh[chat_id] = result.fresh
+                    if result.truncated:
+                        truncated.append(chat_id)
+                except asyncio.TimeoutError:
+                    timed_out.append(chat_id)
+                except Exception:
+                    failed.append(chat_id)
+                per_chat[chat_id] = time.monotonic() - started
+
+        started = time.monotonic()
+        chat_list = list(chat_ids)
+        await asyncio.gather(*(run(chat_id) for chat_id in chat_list))
+        return TickReport(
+            time.monotonic() - started, len(chat_list), failed, timed_out, truncated, per_chat, fetched, fresh, skipped
+        )
@@ -0,0 +1,121 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from matcher import IndexedRule
+
+# 规则的稳定标识：跨规则快照不变，增删其他规则不影响
+RuleId = Tuple[str, Optional[int], Optional[int], Tuple[str, ...]]
+
+
+def rule_id(rule: IndexedRule) -> RuleId:
+    return (rule.owner_id, rule.group_id, rule.user_id, rule.keywords)
+
+
+class RuleStats(NamedTuple):
+    owner_id: str
+    group_id: Optional[int]
+    user_id: Optional[int]
+    keywords: Tuple[str, ...]
+    evaluations: int
+    hits: int
+    seconds: float
+
+
+class OwnerStats(NamedTuple):
+    owner_id: str
+    rules: int
+    evaluations: int
+    hits: int
+    seconds: float
+
+
+class RuleProfiler:
+    """按规则统计匹配开销：被检查次数、命中次数、累计耗时。
+
+    默认关闭，关闭时匹配流程只多一次属性判断。开启后每条规则单独计时，
+    关键词扫描（所有规则共用的一次自动机扫描）的耗时单独记在 scan_seconds。
+    统计只在当前进程内累计，可随时 reset()。
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.started = time.time()
+        self.messages = 0
+        self.scan_seconds = 0.0
+        # rule_id -> [检查次数, 命中次数, 累计秒数]
+        self._stats: Dict[RuleId, List[Any]] = {}
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.messages = 0
+        self.scan_seconds = 0.0
+        self._stats.clear()
+
+    # ---- 由 RulesSnapshot.match 调用 ----
+
+    def record_message(self, scan_seconds: float) -> None:
+        self.messages += 1
+        self.scan_seconds += scan_seconds
+
+    def record(self, rule: IndexedRule, hit: bool, seconds: float) -> None:
+        key = rule_id(rule)
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = self._stats[key] = [0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += hit
+        entry[2] += seconds
+
+    # ---- 报表 ----
+
+    def rules(self, current: Iterable[IndexedRule]) -> List[RuleStats]:
+        """当前各条规则的统计；从未被检查过的规则以 0 列出，已删除的规则不再列出。"""
+        result = []
+        for rule in current:
+            key = rule_id(rule)
+            evaluations, hits, seconds = self._stats.get(key, (0, 0, 0.0))
+            result.append(RuleStats(*key, evaluations, hits, seconds))
+        return result
+
+    def top(self, current: Iterable[IndexedRule], limit: int = 10) -> List[RuleStats]:
+        """累计耗时最多的规则。"""
+        stats = [item for item in self.rules(current) if item.evaluations]
+        stats.sort(key=lambda item: item.seconds, reverse=True)
+        return stats[:limit]
+
+    def dead(self, current: Iterable[IndexedRule]) -> List[RuleStats]:
+        """统计期间一次都没命中的规则，按被检查次数从多到少排列。"""
+        stats = [item for item in self.rules(current) if not item.hits]
+        stats.sort(key=lambda item: item.evaluations, reverse=True)
+        return stats
+
+    def owners(self, current: Iterable[IndexedRule]) -> List[OwnerStats]:
+        """按规则所有者汇总，累计耗时从多到少。"""
+        totals: Dict[str, List[Any]] = {}
+        for item in self.rules(current):
+            entry = totals.setdefault(item.owner_id, [0, 0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += item.evaluations
+            entry[2] += item.hits
+            entry[3] += item.seconds
+        owners = [OwnerStats(owner_id, *entry) for owner_id, entry in totals.items()]
+        owners.sort(key=lambda item: item.seconds, reverse=True)
+        return owners
+
+    def export(self, current: Iterable[IndexedRule]) -> str:
+        """导出为 JSON，便于离线分析。"""
+        current = list(current)
+        return json.dumps(
+            {
+                "started": self.started,
+                "exported": time.time(),
+                "enabled": self.enabled,
+                "messages": self.messages,
+                "scan_seconds": self.scan_seconds,
+                "rules": [item._asdict() for item in self.rules(current)],
+                "owners": [item._asdict() for item in self.owners(current)],
+            },
+            ensure_ascii=False,
+            indent=1,
+        )
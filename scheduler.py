@@ -0,0 +1,108 @@
+import heapq
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class _ChatState:
+    __slots__ = ("interval", "due", "last_live")
+
+    def __init__(self, interval: float, due: float) -> None:
+        self.interval = interval
+        self.due = due
+        self.last_live = 0.0
+
+
+class PollScheduler:
+    """按群自适应轮询间隔的调度器（以下次到期时间为键的小顶堆）。
+
+    - 轮询发现了新消息：间隔减半，越活跃的群查得越勤，最低 min_interval；
+    - 没有任何新消息或拉取失败：间隔翻倍退避，最高 max_interval；
+    - 有新消息但都已由实时监听处理过：说明实时推送在正常工作，
+      间隔至少放宽到 live_interval，轮询只做兜底。
+    """
+
+    def __init__(
+        self,
+        base_interval: float = 10.0,
+        min_interval: float = 3.0,
+        max_interval: float = 300.0,
+        live_interval: float = 120.0,
+    ) -> None:
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.live_interval = live_interval
+        self._heap: List[Tuple[float, int]] = []
+        self._chats: Dict[int, _ChatState] = {}
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def _push(self, chat_id: int, state: _ChatState) -> None:
+        heapq.heappush(self._heap, (state.due, chat_id))
+
+    def sync(self, chat_ids: Iterable[int], now: Optional[float] = None) -> bool:
+        """让调度的群与规则中的群保持一致；新群立即到期。返回群列表是否有变化。"""
+        now = time.monotonic() if now is None else now
+        wanted = set(chat_ids)
+        changed = False
+        for chat_id in list(self._chats):
+            if chat_id not in wanted:
+                del self._chats[chat_id]
+                changed = True
+        for chat_id in wanted:
+            if chat_id not in self._chats:
+                state = _ChatState(self.base_interval, now)
+                self._chats[chat_id] = state
+                self._push(chat_id, state)
+                changed = True
+        return changed
+
+    def pop_due(self, now: Optional[float] = None) -> List[int]:
+        now = time.monotonic() if now is None else now
+        due: List[int] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            when, chat_id = heapq.heappop(heap)
+            state = self._chats.get(chat_id)
+            # 堆里可能残留已删除或已改期的旧条目，直接丢弃
+            if state is None or state.due != when:
+                continue
+            due.append(chat_id)
+        return due
+
+    def next_due(self) -> Optional[float]:
+        heap = self._heap
+        while heap:
+            when, chat_id = heap[0]
+            state = self._chats.get(chat_id)
+            if state is not None and state.due == when:
+                return when
+            heapq.heappop(heap)
+        return None
+
+    def note_live(self, chat_id: int, now: Optional[float] = None) -> None:
+        state = self._chats.get(chat_id)
+        if state is not None:
+            state.last_live = time.monotonic() if now is None else now
+
+    def reschedule(self, chat_id: int, fetched: int, fresh: int, failed: bool = False, now: Optional[float] = None) -> None:
+        state = self._chats.get(chat_id)
+        if state is None:
+            return
+        now = time.monotonic() if now is None else now
+        if failed or fetched == 0:
+            interval = state.interval * 2
+        elif fresh > 0:
+            interval = state.interval / 2
+        elif now - state.last_live <= self.live_interval * 2:
+            interval = max(state.interval, self.live_interval)
+        else:
+            interval = state.interval
+        state.interval = min(self.max_interval, max(self.min_interval, interval))
+        state.due = now + state.interval
+        self._push(chat_id, state)
+
+    def interval(self, chat_id: int) -> Optional[float]:
+        state = self._chats.get(chat_id)
+        return state.interval if state else None
@@ -0,0 +1,215 @@
+import bisect
+import hashlib
+import logging
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import metrics
+from poller import TickReport
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def session_name(session_string: str) -> str:
+    """由 session string 得到稳定的会话名；调整配置里的顺序不会打乱分配。"""
+    return "user-" + hashlib.sha1(session_string.encode("utf-8")).hexdigest()[:6]
+
+
+class HashRing:
+    """一致性哈希环。每个节点放 replicas 个虚拟点，增删一个节点只会移动约 1/N 的群。"""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64) -> None:
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self._nodes: set = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+    def add(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            pos = bisect.bisect(self._points, point)
+            self._points.insert(pos, point)
+            self._owners.insert(pos, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def preference(self, key: str) -> List[str]:
+        """从 key 的位置顺时针经过的不同节点，第一个即负责该 key 的节点。"""
+        if not self._points:
+            return []
+        start = bisect.bisect(self._points, _hash(key))
+        found: List[str] = []
+        total = len(self._owners)
+        for offset in range(total):
+            owner = self._owners[(start + offset) % total]
+            if owner not in found:
+                found.append(owner)
+                if len(found) == len(self._nodes):
+                    break
+        return found
+
+    def node_for(self, key: str) -> Optional[str]:
+        preference = self.preference(key)
+        return preference[0] if preference else None
+
+
+class Session:
+    __slots__ = (
+        "name", "client", "up", "down_until", "streak", "chats",
+        "polls", "fetched", "failures", "timeouts", "busy", "last_error",
+    )
+
+    def __init__(self, name: str, client: Any) -> None:
+        self.name = name
+        self.client = client
+        self.up = True
+        self.down_until = 0.0
+        self.streak = 0
+        self.chats = 0
+        self.polls = 0
+        self.fetched = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.busy = 0.0
+        self.last_error = ""
+
+
+class SessionPool:
+    """多个 userbot 会话，按一致性哈希把群分给健康的会话轮询。
+
+    某个会话连续 max_failures 轮所有群都拉取失败时暂停 retry_after 秒，
+    它的群自动落到环上的下一个会话；到期后重新加入。单个群在当前会话上
+    拉取失败时，改由它偏好列表里的下一个会话负责（比如该账号不在群里），
+    之后一直留在能拉取成功的会话上。
+    去重由调用方全局处理，多个会话看到同一条消息也只会处理一次。
+    """
+
+    def __init__(self, max_failures: int = 3, retry_after: float = 300.0, replicas: int = 64) -> None:
+        self.max_failures = max(1, max_failures)
+        self.retry_after = retry_after
+        self.ring = HashRing(replicas=replicas)
+        self._sessions: Dict[str, Session] = {}
+        self._chat_offset: Dict[int, int] = {}
+        self._watched: frozenset = frozenset()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(self._sessions.values())
+
+    def __getitem__(self, name: str) -> Session:
+        return self._sessions[name]
+
+    @property
+    def healthy(self) -> int:
+        return len(self.ring)
+
+    def add(self, name: str, client: Any, up: bool = True) -> Session:
+        session = self._sessions[name] = Session(name, client)
+        if up:
+            self.ring.add(name)
+        else:
+            session.up = False
+            session.down_until = float("inf")
+        metrics.SESSION_UP.set(1 if up else 0, name)
+        return session
+
+    def mark_down(self, name: str, reason: str, now: Optional[float] = None) -> None:
+        session = self._sessions[name]
+        if not session.up:
+            return
+        session.up = False
+        session.last_error = reason
+        session.down_until = (time.monotonic() if now is None else now) + self.retry_after
+        self.ring.remove(name)
+        metrics.SESSION_UP.set(0, name)
+        self._recount()
+        logger.warning("会话 %s 暂停 %g 秒（%s），其群已分给其他会话", name, self.retry_after, reason)
+
+    def _revive(self, now: float) -> None:
+        revived = False
+        for session in self._sessions.values():
+            if not session.up and session.down_until <= now:
+                session.up = True
+                session.streak = 0
+                self.ring.add(session.name)
+                metrics.SESSION_UP.set(1, session.name)
+                logger.info("会话 %s 恢复，重新参与分配", session.name)
+                revived = True
+        if revived:
+            self._recount()
+
+    def assign(self, chat_ids: Iterable[int], now: Optional[float] = None) -> Dict[str, List[int]]:
+        """把群分给会话；没有健康会话时返回空字典。"""
+        self._revive(time.monotonic() if now is None else now)
+        assignment: Dict[str, List[int]] = {}
+        for chat_id in chat_ids:
+            preference = self.ring.preference(str(chat_id))
+            if not preference:
+                break
+            name = preference[self._chat_offset.get(chat_id, 0) % len(preference)]
+            assignment.setdefault(name, []).append(chat_id)
+        return assignment
+
+    def watch(self, chat_ids: Iterable[int]) -> None:
+        """更新要监听的群，清理已不再监听的群的记录并重新统计各会话的群数。"""
+        self._watched = frozenset(chat_ids)
+        self._chat_offset = {
+            chat_id: offset for chat_id, offset in self._chat_offset.items() if chat_id in self._watched
+        }
+        self._recount()
+
+    def _recount(self) -> None:
+        counts = {name: 0 for name in self._sessions}
+        for chat_id in self._watched:
+            preference = self.ring.preference(str(chat_id))
+            if preference:
+                counts[preference[self._chat_offset.get(chat_id, 0) % len(preference)]] += 1
+        for name, count in counts.items():
+            self._sessions[name].chats = count
+            metrics.SESSION_CHATS.set(count, name)
+
+    def record(self, name: str, report: TickReport) -> None:
+        session = self._sessions[name]
+        failed = set(report.failed) | set(report.timed_out)
+        session.polls += report.chats
+        session.fetched += sum(report.fetched.values())
+        session.failures += len(report.failed)
+        session.timeouts += len(report.timed_out)
+        session.busy += sum(report.per_chat.values())
+        metrics.SESSION_POLLS.inc(name, "ok", amount=report.chats - len(failed))
+        metrics.SESSION_POLLS.inc(name, "failed", amount=len(report.failed))
+        metrics.SESSION_POLLS.inc(name, "timeout", amount=len(report.timed_out))
+        for chat_id in failed:
+            self._chat_offset[chat_id] = self._chat_offset.get(chat_id, 0) + 1
+        if failed and len(self.ring) > 1:
+            self._recount()
+
+        if report.chats and len(failed) == report.chats:
+            session.streak += 1
+            if session.streak >= self.max_failures:
+                self.mark_down(name, f"连续 {session.streak} 轮全部拉取失败")
+        else:
+            session.streak = 0
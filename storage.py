@@ -0,0 +1,416 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS owners (
+    owner_id INTEGER PRIMARY KEY,
+    notify_digest INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    group_id INTEGER,
+    user_id INTEGER,
+    keywords TEXT NOT NULL,
+    rule_key TEXT NOT NULL,
+    UNIQUE (owner_id, rule_key)
+);
+CREATE INDEX IF NOT EXISTS rules_by_group ON rules (group_id);
+CREATE TABLE IF NOT EXISTS notify_targets (
+    owner_id INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    PRIMARY KEY (owner_id, target_id)
+);
+CREATE TABLE IF NOT EXISTS admins (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    chat_id INTEGER PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dedup (
+    chat_id INTEGER PRIMARY KEY,
+    state BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS peers (
+    chat_id INTEGER PRIMARY KEY,
+    username TEXT,
+    title TEXT,
+    peer_type TEXT NOT NULL DEFAULT '',
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS peer_hashes (
+    session TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    access_hash INTEGER NOT NULL,
+    PRIMARY KEY (session, chat_id)
+);
+CREATE TABLE IF NOT EXISTS pending_notifications (
+    instance TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    origin REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (instance, seq)
+);
+"""
+
+# 这些表的任何修改都会让 meta.rules_revision 加一，多进程部署时据此重新加载规则
+SCHEMA += "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS {table}_{action.lower()}_revision AFTER {action} ON {table} BEGIN
+    INSERT INTO meta (key, value) VALUES ('rules_revision', '1')
+    ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+END;"""
+    for table in ("owners", "rules", "notify_targets", "admins")
+    for action in ("INSERT", "UPDATE", "DELETE")
+)
+
+
+def rule_key(rule: Dict[str, Any]) -> str:
+    """规则的哈希键：群、用户、关键词都相同即视为同一条规则。"""
+    raw = json.dumps(
+        [rule.get("group_id"), rule.get("user_id"), list(rule.get("keywords", []))],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Store:
+    """基于 SQLite（WAL 模式）的规则与运行状态存储。
+
+    每次修改只写受影响的行。所有读写都在一个专用线程里串行执行，
+    协程里通过 run() 调用，不会阻塞事件循环。
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+    def _transaction(self, statements: Iterable[Tuple[str, Tuple[Any, ...]]]) -> None:
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---- 规则与通知目标 ----
+
+    def load_data(self) -> Dict[str, Any]:
+        """读出与旧 rules.json 相同结构的 {"users": {...}}。"""
+        users: Dict[str, Any] = {}
+
+        def bucket(owner_id: int) -> Dict[str, Any]:
+            return users.setdefault(str(owner_id), {"notify_targets": [], "rules": []})
+
+        for owner_id, digest in self._conn.execute("SELECT owner_id, notify_digest FROM owners"):
+            if digest:
+                bucket(owner_id)["notify_digest"] = digest
+        for owner_id, group_id, user_id, keywords in self._conn.execute(
+            "SELECT owner_id, group_id, user_id, keywords FROM rules ORDER BY id"
+        ):
+            bucket(owner_id)["rules"].append(
+                {"group_id": group_id, "user_id": user_id, "keywords": json.loads(keywords)}
+            )
+        for owner_id, target_id in self._conn.execute(
+            "SELECT owner_id, target_id FROM notify_targets ORDER BY rowid"
+        ):
+            bucket(owner_id)["notify_targets"].append(target_id)
+        return {"users": users}
+
+    def add_rules(self, owner_id: int, rules: Iterable[Dict[str, Any]]) -> None:
+        """批量添加，整批在一个事务里写入。"""
+        self._transaction(
+            (
+                "INSERT OR IGNORE INTO rules (owner_id, group_id, user_id, keywords, rule_key) VALUES (?, ?, ?, ?, ?)",
+                (
+                    int(owner_id),
+                    rule.get("group_id"),
+                    rule.get("user_id"),
+                    json.dumps(rule.get("keywords", []), ensure_ascii=False),
+                    rule_key(rule),
+                ),
+            )
+            for rule in rules
+        )
+
+    def remove_rules(self, owner_id: int, rules: Iterable[Dict[str, Any]]) -> None:
+        self._transaction(
+            ("DELETE FROM rules WHERE owner_id = ? AND rule_key = ?", (int(owner_id), rule_key(rule)))
+            for rule in rules
+        )
+
+    def normalize_rules(self, normalize: Callable[[str], str], signature: str) -> int:
+        """用当前的文本规范化方式重写已保存的关键词，返回改动的规则数。
+
+        signature 与上次相同时直接跳过。规范化后与已有规则重复的会被删除。
+        """
+        if self.get_meta("keywords_normalized") == signature:
+            return 0
+        rows = list(self._conn.execute("SELECT id, owner_id, group_id, user_id, keywords, rule_key FROM rules ORDER BY id"))
+        keys = {(owner_id, key) for _, owner_id, _, _, _, key in rows}
+        statements: List[Tuple[str, Tuple[Any, ...]]] = []
+        for rule_id, owner_id, group_id, user_id, raw, key in rows:
+            keywords = json.loads(raw)
+            normalized = list(dict.fromkeys(kw for kw in (normalize(kw).strip() for kw in keywords) if kw))
+            if normalized == keywords:
+                continue
+            new_key = rule_key({"group_id": group_id, "user_id": user_id, "keywords": normalized})
+            keys.discard((owner_id, key))
+            if not normalized or (owner_id, new_key) in keys:
+                statements.append(("DELETE FROM rules WHERE id = ?", (rule_id,)))
+                continue
+            keys.add((owner_id, new_key))
+            statements.append((
+                "UPDATE rules SET keywords = ?, rule_key = ? WHERE id = ?",
+                (json.dumps(normalized, ensure_ascii=False), new_key, rule_id),
+            ))
+        statements.append((
+            "INSERT INTO meta (key, value) VALUES ('keywords_normalized', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (signature,),
+        ))
+        self._transaction(statements)
+        return len(statements) - 1
+
+    def add_notify_target(self, owner_id: int, target_id: int) -> None:
+        self._conn.execute(
+            "INSERT OR IGNORE INTO notify_targets (owner_id, target_id) VALUES (?, ?)", (int(owner_id), target_id)
+        )
+
+    def remove_notify_target(self, owner_id: int, target_id: int) -> None:
+        self._conn.execute(
+            "DELETE FROM notify_targets WHERE owner_id = ? AND target_id = ?", (int(owner_id), target_id)
+        )
+
+    def clear_notify_targets(self, owner_id: int) -> None:
+        self._conn.execute("DELETE FROM notify_targets WHERE owner_id = ?", (int(owner_id),))
+
+    def set_notify_digest(self, owner_id: int, window: int) -> None:
+        self._conn.execute(
+            "INSERT INTO owners (owner_id, notify_digest) VALUES (?, ?) "
+            "ON CONFLICT (owner_id) DO UPDATE SET notify_digest = excluded.notify_digest",
+            (int(owner_id), window),
+        )
+
+    # ---- 管理员 ----
+
+    def load_admins(self) -> List[int]:
+        return [row[0] for row in self._conn.execute("SELECT user_id FROM admins ORDER BY rowid")]
+
+    def add_admin(self, user_id: int) -> None:
+        self._conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+
+    def remove_admin(self, user_id: int) -> None:
+        self._conn.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+
+    # ---- 轮询游标与去重状态 ----
+
+    def load_cursors(self) -> Dict[int, int]:
+        return dict(self._conn.execute("SELECT chat_id, last_id FROM cursors"))
+
+    def save_cursors(self, cursors: Dict[int, int]) -> None:
+        self._transaction(
+            (
+                "INSERT INTO cursors (chat_id, last_id) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET last_id = excluded.last_id",
+                (chat_id, last_id),
+            )
+            for chat_id, last_id in cursors.items()
+        )
+
+    def load_dedup(self) -> Dict[int, bytes]:
+        return dict(self._conn.execute("SELECT chat_id, state FROM dedup"))
+
+    def save_dedup(self, states: Dict[int, bytes], removed: Iterable[int] = ()) -> None:
+        statements: List[Tuple[str, Tuple[Any, ...]]] = [
+            ("DELETE FROM dedup WHERE chat_id = ?", (chat_id,)) for chat_id in removed
+        ]
+        statements.extend(
+            (
+                "INSERT INTO dedup (chat_id, state) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET state = excluded.state",
+                (chat_id, state),
+            )
+            for chat_id, state in states.items()
+        )
+        self._transaction(statements)
+
+    # ---- 待发送的通知 ----
+
+    def load_pending(self, instance: str) -> List[Tuple[int, str, float, float]]:
+        return self._conn.execute(
+            "SELECT target, text, created, origin FROM pending_notifications WHERE instance = ? ORDER BY seq",
+            (instance,),
+        ).fetchall()
+
+    def save_pending(self, instance: str, items: Iterable[Tuple[int, str, float, float]]) -> None:
+        """用当前快照整体替换该实例的待发送通知。"""
+        statements: List[Tuple[str, Tuple[Any, ...]]] = [
+            ("DELETE FROM pending_notifications WHERE instance = ?", (instance,))
+        ]
+        statements.extend(
+            (
+                "INSERT INTO pending_notifications (instance, seq, target, text, created, origin) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (instance, seq, *item),
+            )
+            for seq, item in enumerate(items)
+        )
+        self._transaction(statements)
+
+    # ---- 群缓存 ----
+
+    def load_peers(self) -> List[Tuple[int, Optional[str], Optional[str], str, float]]:
+        return self._conn.execute("SELECT chat_id, username, title, peer_type, updated FROM peers").fetchall()
+
+    def load_peer_hashes(self, session: str) -> List[Tuple[int, int, str, Optional[str]]]:
+        """某个会话记录过的 (chat_id, access_hash, peer_type, username)，用于启动时预填 Pyrogram 的会话存储。"""
+        return self._conn.execute(
+            "SELECT h.chat_id, h.access_hash, p.peer_type, p.username FROM peer_hashes h "
+            "JOIN peers p ON p.chat_id = h.chat_id WHERE h.session = ? AND p.peer_type != ''",
+            (session,),
+        ).fetchall()
+
+    def save_peers(
+        self,
+        peers: Iterable[Tuple[int, Optional[str], Optional[str], str, float]],
+        hashes: Iterable[Tuple[str, int, int]] = (),
+    ) -> None:
+        statements: List[Tuple[str, Tuple[Any, ...]]] = [
+            ("INSERT OR REPLACE INTO peers (chat_id, username, title, peer_type, updated) VALUES (?, ?, ?, ?, ?)", tuple(peer))
+            for peer in peers
+        ]
+        statements.extend(
+            ("INSERT OR REPLACE INTO peer_hashes (session, chat_id, access_hash) VALUES (?, ?, ?)", row)
+            for row in hashes
+        )
+        self._transaction(statements)
+
+    # ---- 元数据 ----
+
+    def rules_revision(self) -> int:
+        """规则、通知设置或管理员每改一行就加一（由触发器维护），用来发现其他进程的修改。"""
+        return int(self.get_meta("rules_revision") or 0)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    raw = path.read_text(encoding="utf-8")
+    if not raw.strip():
+        return {}
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def migrate_json(store: Store, rules_path: Path, admins_path: Path, cursors_path: Optional[Path] = None) -> bool:
+    """把旧的 rules.json / admins.json / cursors.json 一次性导入数据库。
+
+    只在数据库从未导入过时执行，返回是否做了导入。兼容旧版单个
+    notify_target 字段。
+    """
+    if store.get_meta("json_migrated"):
+        return False
+
+    statements: List[Tuple[str, Tuple[Any, ...]]] = []
+    users = _read_json(rules_path).get("users", {})
+    for owner_id, bucket in (users.items() if isinstance(users, dict) else []):
+        owner = int(owner_id)
+        targets = bucket.get("notify_targets")
+        if targets is None:
+            old_target = bucket.get("notify_target")
+            targets = [old_target] if old_target else []
+        for target_id in targets:
+            statements.append(
+                ("INSERT OR IGNORE INTO notify_targets (owner_id, target_id) VALUES (?, ?)", (owner, int(target_id)))
+            )
+        if bucket.get("notify_digest"):
+            statements.append(
+                ("INSERT OR REPLACE INTO owners (owner_id, notify_digest) VALUES (?, ?)", (owner, int(bucket["notify_digest"])))
+            )
+        for rule in bucket.get("rules", []):
+            statements.append((
+                "INSERT OR IGNORE INTO rules (owner_id, group_id, user_id, keywords, rule_key) VALUES (?, ?, ?, ?, ?)",
+                (
+                    owner,
+                    rule.get("group_id"),
+                    rule.get("user_id"),
+                    json.dumps(rule.get("keywords", []), ensure_ascii=False),
+                    rule_key(rule),
+                ),
+            ))
+
+    for user_id in _read_json(admins_path).get("admins", []):
+        statements.append(("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (int(user_id),)))
+
+    if cursors_path is not None:
+        for chat_id, last_id in _read_json(cursors_path).get("cursors", {}).items():
+            statements.append(
+                ("INSERT OR REPLACE INTO cursors (chat_id, last_id) VALUES (?, ?)", (int(chat_id), int(last_id)))
+            )
+
+    statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')", ()))
+    store._transaction(statements)
+    return True
+
+
+if __name__ == "__main__":
+    import config
+
+    if sys.argv[1:] != ["migrate"]:
+        raise SystemExit("用法：python storage.py migrate")
+    db = Store(config.DB_PATH)
+    try:
+        if migrate_json(db, config.RULES_PATH, config.ADMINS_PATH, config.CURSORS_PATH):
+            data = db.load_data()
+            total = sum(len(bucket["rules"]) for bucket in data["users"].values())
+            print(f"✅ 已导入 {len(data['users'])} 个用户、{total} 条规则到 {config.DB_PATH}")
+        else:
+            print(f"{config.DB_PATH} 已导入过，跳过。")
+    finally:
+        db.close()